@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register the signal receivers
+        from . import signals  # noqa: F401
+        from .middleware import install_wrapper
+        if settings.QUERY_INSTRUMENTATION or settings.METRICS_ENABLED:
+            # Every connection, in any thread, records its queries for the middleware
+            connection_created.connect(install_wrapper, dispatch_uid='query_instrumentation')
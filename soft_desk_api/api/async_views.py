@@ -0,0 +1,201 @@
+"""
+Asynchronous views, served without a thread per request under ASGI.
+
+Under ASGI the DRF viewsets run in the single thread shared by every sync
+view, so concurrent requests queue behind each other. The read views
+below return the same data through the async ORM: only the queries
+themselves go through that thread.
+"""
+import asyncio
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied
+from rest_framework.request import Request
+
+from . import events, membership
+from .authentication import CachedJWTAuthentication
+from .models import Comment, Project, Ticket, User
+from .pagination import CappedLimitOffsetPagination
+from .renderers import ORJSONRenderer
+from .serializers import (
+    CommentSerializer, ProjectDetailSerializer, ProjectSerializer,
+    TicketDetailSerializer, TicketSerializer
+)
+from .views import CommentViewSet, TicketViewSet
+
+
+async def authenticate(request):
+    "Resolve the user of the Authorization header, None when there is none."
+    try:
+        result = await CachedJWTAuthentication().aauthenticate(request)
+    except APIException:
+        return None
+    return result[0] if result else None
+
+
+def render(data, status=200):
+    return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error(detail, status):
+    return render({'detail': detail}, status)
+
+
+def async_read_view(view):
+    "Allow GET only, authenticate the request and render the returned data as JSON."
+    @functools.wraps(view)
+    async def wrapper(request, **kwargs):
+        if request.method != 'GET':
+            return error('Method not allowed.', 405)
+        request.user = await authenticate(request)
+        if request.user is None:
+            return error('Authentication credentials were not provided.', 401)
+        try:
+            return render(await view(request, **kwargs))
+        except APIException as exc:
+            return render(exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail},
+                          exc.status_code)
+    return wrapper
+
+
+async def aget_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise NotFound()
+
+
+async def paginate(request, queryset, serializer_class, view=None):
+    """
+    Page of the queryset, same output as the sync list of ``view``.
+
+    The lists of the viewsets paged by cursor (CursorPaginationMixin) get the
+    same cursor pages, without COUNT(*) nor OFFSET, unless the client asks
+    for ``?pagination=offset``; the others are paged by limit/offset.
+    """
+    request = Request(request)
+    if view is not None and request.query_params.get('pagination') != 'offset':
+        paginator = view.pagination_class()
+        # CursorPagination has no async API: its single query goes through the
+        # thread of the sync views, like every async ORM call does
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, request, view)
+    else:
+        paginator = CappedLimitOffsetPagination()
+        paginator.request = request
+        paginator.limit = paginator.get_limit(request)
+        paginator.offset = paginator.get_offset(request)
+        paginator.count = await queryset.acount()
+        page = [obj async for obj in queryset[paginator.offset:paginator.offset + paginator.limit]]
+    return paginator.get_paginated_response(serializer_class(page, many=True).data).data
+
+
+async def check_contributor(user, project_id):
+    if not (user.is_superuser or await membership.ais_project_contributor(user, project_id)):
+        raise PermissionDenied('You do not have permission to do this action')
+
+
+# Same querysets as the sync viewsets: the serializers must not run lazy
+# queries, which the async context refuses
+
+@async_read_view
+async def project_list(request):
+    return await paginate(request, Project.objects.order_by('id'), ProjectSerializer)
+
+
+@async_read_view
+async def project_detail(request, pk):
+    queryset = Project.objects.select_related('creator').prefetch_related(
+        Prefetch('contributor', queryset=User.objects.only('id', 'username').order_by('id')))
+    return ProjectDetailSerializer(await aget_or_404(queryset, pk=pk)).data
+
+
+@async_read_view
+async def ticket_list(request, project_pk):
+    if not await Project.objects.filter(pk=project_pk).aexists():
+        raise NotFound('Project not found.')
+    queryset = Ticket.objects.filter(project_id=project_pk)
+    drf_request = Request(request)
+    # Same ?status=&priority=&ticket_type=&assigned_to= filters and ?ordering= as the sync list
+    for backend in TicketViewSet.filter_backends:
+        queryset = backend().filter_queryset(drf_request, queryset, TicketViewSet)
+    return await paginate(request, queryset, TicketSerializer, TicketViewSet)
+
+
+@async_read_view
+async def ticket_detail(request, project_pk, pk):
+    queryset = Ticket.objects.filter(project_id=project_pk).select_related(
+        'affected_user', 'assigned_to', 'project')
+    ticket = await aget_or_404(queryset, pk=pk)
+    await check_contributor(request.user, ticket.project_id)
+    return TicketDetailSerializer(ticket).data
+
+
+async def comment_queryset(project_pk, ticket_pk):
+    if not await Ticket.objects.filter(pk=ticket_pk, project_id=project_pk).aexists():
+        raise NotFound('Ticket not found.')
+    return Comment.objects.filter(parent_ticket_id=ticket_pk).select_related(
+        'contributor', 'parent_ticket').order_by('created_at', 'id')
+
+
+@async_read_view
+async def comment_list(request, project_pk, ticket_pk):
+    return await paginate(
+        request, await comment_queryset(project_pk, ticket_pk), CommentSerializer, CommentViewSet)
+
+
+@async_read_view
+async def comment_detail(request, project_pk, ticket_pk, pk):
+    comment = await aget_or_404(await comment_queryset(project_pk, ticket_pk), pk=pk)
+    return CommentSerializer(comment).data
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def stream_events(broker, subscription, heartbeat):
+    try:
+        # Clients wait 3s before reconnecting, then resync from /changes/
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = await subscription.get(heartbeat)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            if event is None:
+                yield 'event: overflow\ndata: {}\n\n'
+                return
+            yield format_event(event)
+    finally:
+        # Also runs when the client disconnects and the response is cancelled
+        broker.unsubscribe(subscription)
+
+
+async def project_events(request, pk):
+    "Server-Sent Events stream of the tickets and comments of a project."
+    if request.method != 'GET':
+        return error('Method not allowed.', 405)
+    user = await authenticate(request)
+    if user is None:
+        return error('Authentication credentials were not provided.', 401)
+    if not await Project.objects.filter(pk=pk).aexists():
+        return error('Not found.', 404)
+    if not (user.is_superuser or await membership.ais_project_contributor(user, pk)):
+        return error('You do not have permission to do this action', 403)
+
+    broker = events.get_broker()
+    subscription = broker.subscribe(pk)
+    response = StreamingHttpResponse(
+        stream_events(broker, subscription, settings.EVENT_STREAM_HEARTBEAT),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disables response buffering in nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,162 @@
+"""
+Endpoint benchmarks: latency and SQL query counts of every API route.
+
+``seed`` fills the current database with a synthetic data set scaled on
+the number of tickets, ``run`` calls every benchmarked route through the
+test client and ``compare`` flags the regressions of a report against a
+baseline report. ``manage.py bench_endpoints`` runs them on a fresh
+database for each size.
+"""
+import statistics
+import time
+from collections import namedtuple
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import seeding
+from .models import Comment, Project, Ticket
+
+
+PASSWORD = 'benchmark-password'
+
+# Routes left out of the benchmarks, with the reason
+NOT_BENCHMARKED = {
+    'api-root': 'static router index',
+    'project-events': 'Server-Sent Events stream, never completes',
+    'project-import-tickets': 'file upload, see manage.py import_ndjson',
+    'project-contributors': 'changes the data set',
+    'metrics': 'monitoring endpoint, reads files only',
+}
+
+Case = namedtuple('Case', 'name route method path data repeat', defaults=(None, None))
+
+
+def seed(tickets):
+    """
+    Create a data set around ``tickets`` tickets with api.seeding.
+
+    One project holds half of the tickets, the rest is spread over a long
+    tail of small projects; there are two comments per ticket on average.
+    """
+    return seeding.seed(
+        users=max(10, tickets // 100), projects=max(2, tickets // 1000), tickets=tickets,
+        comments=tickets * 2, huge_projects=1, password=PASSWORD, prefix='bench', seed=tickets)
+
+
+def build_cases():
+    "Return the benchmark cases for the data set in the database."
+    project = Project.objects.order_by('-incidents_count', 'id').first()
+    ticket = Ticket.objects.filter(project=project, comment_count__gt=0).order_by('id').first()
+    comment = Comment.objects.filter(parent_ticket=ticket).order_by('id').first()
+    user = ticket.affected_user
+    deep_offset = max(0, project.incidents_count - 10)
+    p = f'/api/project/{project.id}'
+    t = f'{p}/ticket/{ticket.id}'
+    # Same paths under /api/async/
+    async_p = f'/api/async/project/{project.id}'
+    async_t = f'{async_p}/ticket/{ticket.id}'
+    return user, [
+        Case('token obtain', 'token_obtain_pair', 'post', '/api/token/',
+             {'username': user.username, 'password': PASSWORD}),
+        Case('token refresh', 'token_refresh', 'post', '/api/token/refresh/',
+             {'refresh': str(RefreshToken.for_user(user))}),
+        Case('user list', 'user-list', 'get', '/api/user/'),
+        Case('user detail', 'user-detail', 'get', f'/api/user/{user.id}/'),
+        Case('project list', 'project-list', 'get', '/api/project/'),
+        Case('project detail', 'project-detail', 'get', f'{p}/'),
+        Case('project stats', 'project-stats', 'get', f'{p}/stats/'),
+        Case('project search', 'project-search', 'get', f'{p}/search/?q=ticket'),
+        Case('project changes', 'project-changes', 'get', f'{p}/changes/'),
+        Case('project export', 'project-export', 'get', f'{p}/export/', repeat=3),
+        Case('ticket list', 'ticket-list', 'get', f'{p}/ticket/'),
+        Case('ticket list filtered', 'ticket-list', 'get',
+             f'{p}/ticket/?status=in_progress&priority=high&ordering=-created_at'),
+        Case('ticket list deep offset', 'ticket-list', 'get', f'{p}/ticket/?pagination=offset&offset={deep_offset}'),
+        Case('ticket detail', 'ticket-detail', 'get', f'{t}/'),
+        Case('ticket create', 'ticket-list', 'post', f'{p}/ticket/', {'title': 'Benchmark', 'details': 'Details'}),
+        Case('ticket update', 'ticket-detail', 'patch', f'{t}/', {'title': 'Benchmarked'}),
+        Case('ticket batch', 'ticket-batch', 'post', f'{p}/ticket/batch/',
+             [{'title': f'Batch {i}', 'details': 'Details'} for i in range(20)]),
+        Case('comment list', 'comment-list', 'get', f'{t}/comment/'),
+        Case('comment detail', 'comment-detail', 'get', f'{t}/comment/{comment.id}/'),
+        Case('comment create', 'comment-list', 'post', f'{t}/comment/', {'text': 'Benchmark comment'}),
+        Case('async project list', 'async', 'get', '/api/async/project/'),
+        Case('async ticket list', 'async', 'get', f'{async_p}/ticket/'),
+        Case('async ticket detail', 'async', 'get', f'{async_t}/'),
+        Case('async comment list', 'async', 'get', f'{async_t}/comment/'),
+    ]
+
+
+def not_covered(cases):
+    "Return the named routes without a benchmark case and not listed in NOT_BENCHMARKED."
+    names = {name for name in get_resolver().reverse_dict if isinstance(name, str)}
+    return sorted(names - {case.route for case in cases} - set(NOT_BENCHMARKED))
+
+
+def run_case(client, case, repeat):
+    latencies = []
+    queries = 0
+    for _ in range(case.repeat or repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            if case.method == 'get':
+                response = client.get(case.path)
+            else:
+                response = getattr(client, case.method)(case.path, case.data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            raise AssertionError(f'{case.method.upper()} {case.path} answered {response.status_code}')
+        queries = max(queries, len(context.captured_queries))
+    latencies.sort()
+    return {
+        'route': case.route,
+        'method': case.method.upper(),
+        'path': case.path,
+        'status': response.status_code,
+        'requests': len(latencies),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        'queries': queries,
+    }
+
+
+def run(repeat=50):
+    "Benchmark every case against the current database."
+    user, cases = build_cases()
+    token = RefreshToken.for_user(user).access_token
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    results = {}
+    for case in cases:
+        # Warm up the caches a real server would have
+        run_case(client, case._replace(repeat=1), 1)
+        results[case.name] = run_case(client, case, repeat)
+    return {'cases': results, 'not_covered': not_covered(cases), 'not_benchmarked': NOT_BENCHMARKED}
+
+
+def compare(report, baseline, tolerance=0.2, min_ms=1.0):
+    """
+    Return the regressions of a report against a baseline report.
+
+    A case regresses when it runs more queries, or when its p50 or p99 grew
+    by more than ``tolerance`` and by at least ``min_ms`` milliseconds.
+    """
+    regressions = []
+    for size, result in report['sizes'].items():
+        base_cases = baseline.get('sizes', {}).get(size, {}).get('cases', {})
+        for name, case in result['cases'].items():
+            base = base_cases.get(name)
+            if base is None:
+                continue
+            if case['queries'] > base['queries']:
+                regressions.append(f"{size} {name}: {base['queries']} -> {case['queries']} queries")
+            for metric in ('p50_ms', 'p99_ms'):
+                if case[metric] > base[metric] * (1 + tolerance) and case[metric] - base[metric] >= min_ms:
+                    regressions.append(f"{size} {name}: {metric} {base[metric]} -> {case[metric]}")
+    return regressions
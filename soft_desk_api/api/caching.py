@@ -0,0 +1,21 @@
+"Choice of the cache for data every worker process must see the same way."
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def shared_cache(alias):
+    """
+    Return the cache of ``alias``, or the default cache when it is shared
+    between processes. None when the only cache is private to the process.
+
+    An explicit alias is trusted to be shared.
+    """
+    if alias:
+        return caches[alias]
+    cache = caches['default']
+    # An invalidation in one worker would leave the copies of the others stale
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
@@ -0,0 +1,78 @@
+"""
+Denormalized counters: Project.incidents_count and Ticket.comment_count.
+
+The counters are changed with ``F()`` expressions so concurrent writers do
+not lose updates, and model saves leave them out (CounterFieldsMixin). The
+``reconcile_counters`` management command repairs any drift.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import etags
+from .models import Comment, Project, Ticket
+
+
+# Counter field -> (counted model, foreign key to the counter model)
+COUNTERS = {
+    (Project, 'incidents_count'): (Ticket, 'project'),
+    (Ticket, 'comment_count'): (Comment, 'parent_ticket'),
+}
+
+
+def increment(model, field, deltas):
+    """
+    Add ``deltas[pk]`` to the counter of each row.
+
+    Rows sharing the same delta are updated together: one UPDATE per
+    distinct delta value.
+    """
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def _real_count(counted_model, foreign_key):
+    return Coalesce(Subquery(
+        counted_model.objects.filter(**{foreign_key: OuterRef('pk')})
+        .order_by().values(foreign_key).annotate(count=Count('pk')).values('count')
+    ), Value(0))
+
+
+def _etag_scopes(model, pks):
+    "ETag scopes of the responses showing the counter of the given rows."
+    if model is Project:
+        return [('project', pk) for pk in pks]
+    # The ticket list of the project shows the comment count of each ticket
+    project_ids = set(Ticket.objects.filter(pk__in=pks).values_list('project_id', flat=True))
+    return [('ticket', pk) for pk in pks] + [('project', project_id) for project_id in project_ids]
+
+
+def reconcile(model, field, batch_size=1000):
+    """
+    Recompute a counter from the counted rows, one primary key range per transaction.
+
+    Yields the number of repaired rows of each batch.
+    """
+    counted_model, foreign_key = COUNTERS[(model, field)]
+    last_pk = 0
+    while True:
+        pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        real_count = _real_count(counted_model, foreign_key)
+        with transaction.atomic():
+            drifted = list(model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).annotate(
+                real_count=real_count
+            ).exclude(**{field: F('real_count')}).values_list('pk', flat=True))
+            if drifted:
+                model.objects.filter(pk__in=drifted).update(**{field: real_count})
+                # update() sends no signal: invalidate the cached responses showing the counters
+                etags.bump(*_etag_scopes(model, drifted))
+        yield len(drifted)
+        last_pk = pks[-1]
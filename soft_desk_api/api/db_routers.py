@@ -0,0 +1,132 @@
+"""
+Routing of the reads of the API to the database replicas.
+
+Only the GET/HEAD requests of the viewsets using ReplicaReadMixin read
+from a replica; everything else (writes, signal receivers, management
+commands) uses the primary. After a write, the reads of that user stick
+to the primary for ``REPLICA_STICKY_SECONDS`` so they see their own
+changes. A replica is skipped while its replicated heartbeat is older
+than ``REPLICA_MAX_LAG_SECONDS`` or it cannot be queried.
+"""
+import contextvars
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ReplicaHeartbeat
+
+
+PIN_KEY = 'replica:pin:{}'
+
+# True while a viewset serves a read that may use a replica
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+# {alias: (checked at, healthy)}, local to the process
+_health = {}
+_health_lock = threading.Lock()
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+def replica_lag(alias):
+    "Age in seconds of the heartbeat replicated to a replica, None when it cannot be read."
+    try:
+        beat_at = ReplicaHeartbeat.objects.using(alias).values_list('beat_at', flat=True).first()
+    except DatabaseError:
+        return None
+    if beat_at is None:
+        return None
+    return (timezone.now() - beat_at).total_seconds()
+
+
+def healthy_replicas():
+    now = time.monotonic()
+    healthy = []
+    for alias in settings.DATABASE_REPLICAS:
+        with _health_lock:
+            checked = _health.get(alias)
+        if checked is None or now - checked[0] >= settings.REPLICA_HEALTH_CHECK_INTERVAL:
+            lag = replica_lag(alias)
+            checked = (now, lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS)
+            with _health_lock:
+                _health[alias] = checked
+        if checked[1]:
+            healthy.append(alias)
+    return healthy
+
+
+def write_heartbeat():
+    "Record the current time on the primary, replicas receive it with the other writes."
+    ReplicaHeartbeat.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        pk=1, defaults={'beat_at': timezone.now()})
+
+
+@receiver(setting_changed)
+def reset_health(setting, **kwargs):
+    if setting.startswith('DATABASE_REPLICAS') or setting.startswith('REPLICA_'):
+        with _health_lock:
+            _health.clear()
+
+
+def pin_to_primary(user_id):
+    cache.set(PIN_KEY.format(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+def reads_from_replica():
+    "Return True when the reads of the current request go to a replica."
+    return _replica_reads.get() and bool(healthy_replicas())
+
+
+class ReplicaReadMixin:
+    "Serve the safe requests of a viewset from the replicas, unless the user wrote recently."
+
+    # Actions that must always read from the primary
+    primary_read_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication and permission checks read from the primary
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if request.method in ('GET', 'HEAD') and settings.DATABASE_REPLICAS \
+                and self.action not in self.primary_read_actions \
+                and not (user.is_authenticated and is_pinned(user.pk)):
+            self._replica_reads_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_reads_token', None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_reads_token = None
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+                and request.user.is_authenticated:
+            pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
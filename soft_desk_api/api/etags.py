@@ -0,0 +1,125 @@
+"""
+ETags computed from version counters kept in the cache.
+
+Each cached resource depends on a few scopes, e.g. ``('project', 3)``. The
+signal receivers bump the counter of a scope once the transaction changing
+it commits, so an ETag can be recomputed from a single cache lookup
+without touching the main tables. Counters start at a random value: when
+the cache is cleared or a counter expires, old ETags cannot match the new
+counters.
+
+Every process must see the same counters: a bump in one worker has to
+invalidate the ETags served by the others. The counters live in the
+``ETAG_CACHE`` cache; when it is not set, ETags are only emitted if the
+default cache is shared between processes, i.e. neither a LocMemCache
+nor a DummyCache.
+"""
+import hashlib
+import random
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import db_routers
+from .caching import shared_cache
+
+
+KEY = 'etag:{}:{}'
+# Version of every username, nested in most responses
+USERS = ('users', 0)
+
+
+def _initial_version():
+    return random.getrandbits(62)
+
+
+def get_cache():
+    "The cache holding the counters, None when it is private to the process."
+    # A per-process cache would keep serving ETags another worker has invalidated
+    return shared_cache(settings.ETAG_CACHE)
+
+
+def is_enabled():
+    return get_cache() is not None
+
+
+def get_versions(scopes):
+    "Return the current version of each scope, creating the missing counters."
+    cache = get_cache()
+    keys = [KEY.format(*scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), settings.ETAG_VERSION_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump_now(scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = KEY.format(*scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter expired or was evicted: restart from a new random value
+            cache.add(key, _initial_version(), settings.ETAG_VERSION_TIMEOUT)
+
+
+def bump(*scopes):
+    """
+    Invalidate the ETags depending on the given scopes.
+
+    The counters are bumped after the commit: bumping earlier would let a
+    concurrent request pair the new version with the old data.
+    """
+    scopes = [scope for scope in scopes if scope[1] is not None]
+    if scopes and is_enabled():
+        transaction.on_commit(lambda: _bump_now(scopes))
+
+
+class ConditionalGetMixin:
+    """
+    Add ETag/If-None-Match support to the list and retrieve actions.
+
+    Views return the scopes a response depends on from ``get_etag_scopes``,
+    or None to disable conditional requests for an action.
+    """
+
+    def get_etag_scopes(self):
+        return None
+
+    def get_etag(self, request):
+        # A lagging replica would pair the current versions with older data
+        if db_routers.reads_from_replica() or not is_enabled():
+            return None
+        scopes = self.get_etag_scopes()
+        if not scopes:
+            return None
+        # Views pass the URL kwargs: '05' resolves the same row as 5, but only 5 is ever bumped
+        try:
+            scopes = [(name, int(scope_id)) for name, scope_id in scopes]
+        except (TypeError, ValueError):
+            return None
+        parts = [request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+        parts.extend(str(version) for version in get_versions(scopes))
+        return '"{}"'.format(hashlib.blake2b('|'.join(parts).encode(), digest_size=16).hexdigest())
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None:
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+            if etag in [value.strip() for value in if_none_match.split(',')]:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
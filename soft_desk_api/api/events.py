@@ -0,0 +1,151 @@
+"""
+Project activity events pushed to the Server-Sent Events stream.
+
+The signal receivers publish an event once the transaction commits; the
+broker delivers it to the subscribers of the project. The broker class
+is set by ``EVENT_BROKER['BACKEND']`` so the in-process broker can be
+replaced, e.g. by one relaying events between worker processes.
+"""
+import asyncio
+import itertools
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    "Bounded queue of the events of one project for one client."
+
+    def __init__(self, project_id, max_size):
+        self.project_id = project_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_size)
+        self.overflowed = False
+
+    def put(self, event):
+        # Runs in the event loop of the subscriber
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind must reconnect and resync, an event
+            # dropped silently would leave it with stale data
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        "Return the next event, None once overflowed; raise TimeoutError when idle."
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class BaseBroker:
+    "Interface of the event brokers."
+
+    def __init__(self, options):
+        self.options = options
+
+    def publish(self, project_id, event):
+        "Deliver an event to the subscribers of a project; called from any thread."
+        raise NotImplementedError
+
+    def subscribe(self, project_id):
+        "Return a Subscription; called from the event loop of the subscriber."
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Broker delivering the events published in this process.
+
+    Subscribers only cost a small queue each, so a single ASGI worker can
+    hold many idle streams. Events published by other processes (another
+    worker, a management command) are not seen.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.max_size = options.get('QUEUE_SIZE', 100)
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+
+    def publish(self, project_id, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(project_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The loop of the subscriber is closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, project_id):
+        subscription = Subscription(project_id, self.max_size)
+        with self.lock:
+            self.subscriptions.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.project_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.project_id]
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+
+_broker = None
+_broker_lock = threading.Lock()
+_event_ids = itertools.count(1)
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = settings.EVENT_BROKER
+            _broker = import_string(config['BACKEND'])(config.get('OPTIONS', {}))
+        return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'EVENT_BROKER':
+        with _broker_lock:
+            _broker = None
+
+
+def publish(project_id, event_type, data):
+    "Publish an event to the subscribers of a project after the commit."
+    if project_id is None:
+        return
+    event = {'id': next(_event_ids), 'type': event_type, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(project_id, event))
+
+
+def ticket_data(ticket):
+    return {
+        'id': ticket.pk,
+        'title': ticket.title,
+        'status': ticket.status,
+        'priority': ticket.priority,
+        'ticket_type': ticket.ticket_type,
+        'assigned_to': ticket.assigned_to_id,
+    }
+
+
+def comment_data(comment):
+    return {'id': comment.pk, 'ticket': comment.parent_ticket_id, 'text': comment.text}
@@ -0,0 +1,121 @@
+"""
+Streaming export of the tickets of a project with their comments.
+
+Tickets are read through a single cursor with a chunked
+``QuerySet.iterator()``; the comments of each chunk of tickets are fetched
+with one extra query, so the export runs ``1 + ceil(tickets / chunk_size)``
+queries and only one chunk is held in memory at a time.
+
+Under ASGI, Django buffers a sync iterator whole before sending it, see
+``aiter_lines``.
+"""
+import csv
+import datetime
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Comment, Ticket
+
+
+CHUNK_SIZE = 2000
+# Lines produced per trip to the sync thread when streaming under ASGI
+ASYNC_BATCH_SIZE = 500
+
+TICKET_FIELDS = [
+    'id', 'project_id', 'title', 'details', 'priority', 'status', 'ticket_type',
+    'affected_user_id', 'assigned_to_id', 'created_at',
+]
+COMMENT_FIELDS = ['id', 'parent_ticket_id', 'contributor_id', 'contributor_name', 'text', 'created_at']
+
+# One CSV layout for both record types, the unused columns are left empty
+CSV_COLUMNS = ['type'] + TICKET_FIELDS + ['parent_ticket_id', 'contributor_id', 'contributor_name', 'text']
+
+
+def iter_records(project_id, chunk_size=CHUNK_SIZE):
+    "Yield each ticket of the project followed by its comments, as dicts."
+    tickets = Ticket.objects.filter(project_id=project_id).order_by('id').values(*TICKET_FIELDS)
+    chunk = []
+    for ticket in tickets.iterator(chunk_size=chunk_size):
+        chunk.append(ticket)
+        if len(chunk) >= chunk_size:
+            yield from _join_comments(chunk)
+            chunk = []
+    if chunk:
+        yield from _join_comments(chunk)
+
+
+def _join_comments(tickets):
+    comments = {}
+    queryset = Comment.objects.filter(
+        parent_ticket_id__in=[ticket['id'] for ticket in tickets]
+    ).order_by('parent_ticket_id', 'id').values(*COMMENT_FIELDS)
+    for comment in queryset:
+        comments.setdefault(comment['parent_ticket_id'], []).append(comment)
+    for ticket in tickets:
+        yield 'ticket', ticket
+        for comment in comments.get(ticket['id'], ()):
+            yield 'comment', comment
+
+
+class ExportJSONEncoder(DjangoJSONEncoder):
+    # Keep the microseconds of the timestamps so an import restores them exactly
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def iter_ndjson(project_id, chunk_size=CHUNK_SIZE):
+    "Yield one JSON document per line: {\"type\": \"ticket\" | \"comment\", ...}."
+    encoder = ExportJSONEncoder(ensure_ascii=False)
+    for record_type, record in iter_records(project_id, chunk_size):
+        yield encoder.encode({'type': record_type, **record}) + '\n'
+
+
+class _Echo:
+    # File-like object handing back what csv.writer writes, to stream the rows
+    def write(self, value):
+        return value
+
+
+def iter_csv(project_id, chunk_size=CHUNK_SIZE):
+    "Yield CSV lines, a header then one row per ticket or comment."
+    writer = csv.DictWriter(_Echo(), fieldnames=CSV_COLUMNS)
+    yield writer.writeheader()
+    for record_type, record in iter_records(project_id, chunk_size):
+        row = {'type': record_type, **record}
+        if 'created_at' in row:
+            row['created_at'] = row['created_at'].isoformat()
+        yield writer.writerow(row)
+
+
+def _next_batch(lines, size):
+    return ''.join(itertools.islice(lines, size))
+
+
+async def aiter_lines(lines, batch_size=ASYNC_BATCH_SIZE):
+    """
+    Stream a sync line iterator from the event loop.
+
+    Each batch of lines is produced in the thread of the sync views, where
+    the database connection of the request lives; only one batch is held
+    in memory at a time.
+    """
+    next_batch = sync_to_async(_next_batch)
+    try:
+        while True:
+            batch = await next_batch(lines, batch_size)
+            if not batch:
+                return
+            yield batch
+    finally:
+        # Releases the database cursor when the client disconnects early
+        await sync_to_async(lines.close)()
+
+
+FORMATS = {
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+    'csv': (iter_csv, 'text/csv'),
+}
@@ -0,0 +1,81 @@
+"""
+Read-only fast path for the list responses of flat serializers.
+
+When every field of a list serializer maps to a column of the model, the
+rows are read with ``values()`` and turned into output dicts by a field
+plan compiled once per response, instead of building a model instance
+and walking the serializer fields for every row. The output is the same
+as the serializer's: fields that do not simply return their value keep
+their own ``to_representation``.
+"""
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.response import Response
+
+
+# Fields whose to_representation returns the stored value unchanged
+# (int(value) for an integer column, str(value) for a text column)
+IDENTITY_FIELDS = (serializers.IntegerField, serializers.CharField)
+RELATED_FIELDS = (
+    serializers.BaseSerializer, serializers.RelatedField,
+    serializers.ManyRelatedField, serializers.SerializerMethodField,
+)
+
+
+class FieldPlan:
+    "Output name, column and converter of every field of a flat serializer."
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [column for _, column, _ in fields]
+
+    @classmethod
+    def compile(cls, serializer):
+        "Return the plan of a serializer, None when a field is not a plain column."
+        model = serializer.Meta.model
+        fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, RELATED_FIELDS) or field.source == '*' or '.' in field.source:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if model_field.is_relation:
+                return None
+            # Exact types only: subclasses may convert the value
+            convert = None if type(field) in IDENTITY_FIELDS else field.to_representation
+            fields.append((name, model_field.attname, convert))
+        return cls(fields)
+
+    def to_representation(self, rows):
+        return [
+            {
+                name: value if convert is None or value is None else convert(value)
+                for name, column, convert in self.fields
+                for value in (row[column],)
+            }
+            for row in rows
+        ]
+
+
+class ValuesListMixin:
+    "Serve the list action from values() rows when the list serializer is flat."
+
+    def list(self, request, *args, **kwargs):
+        plan = FieldPlan.compile(self.get_serializer()) if settings.FAST_LIST_SERIALIZATION else None
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        # The cursor paginator reads its position from the ordering columns of the last row
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        columns = list(dict.fromkeys(plan.columns + ordering))
+        rows = queryset.values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.to_representation(page))
+        return Response(plan.to_representation(rows))
@@ -0,0 +1,58 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import Ticket
+
+
+class TicketFilterBackend(BaseFilterBackend):
+    """
+    Filter tickets on ``status``, ``priority``, ``ticket_type`` and ``assigned_to``.
+
+    Several values can be given separated by commas, ``assigned_to=none``
+    returns the unassigned tickets. Every combination is served by one of
+    the composite indexes declared on Ticket.
+    """
+    choice_filters = {
+        'status': Ticket.STATUS_CHOICES,
+        'priority': Ticket.PRIORITY_CHOICES,
+        'ticket_type': Ticket.TICKET_TYPE_CHOICES,
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {}
+        for param, choices in self.choice_filters.items():
+            values = self.get_values(request, param)
+            if values is None:
+                continue
+            allowed = {choice for choice, _ in choices}
+            invalid = [value for value in values if value not in allowed]
+            if invalid:
+                raise ValidationError({param: f'Invalid values {invalid}, choose from {sorted(allowed)}.'})
+            filters[f'{param}__in'] = values
+
+        assigned_to = self.get_values(request, 'assigned_to')
+        if assigned_to == ['none']:
+            filters['assigned_to__isnull'] = True
+        elif assigned_to is not None:
+            if not all(value.isdigit() for value in assigned_to):
+                raise ValidationError({'assigned_to': 'Expected user ids or "none".'})
+            filters['assigned_to__in'] = [int(value) for value in assigned_to]
+
+        return queryset.filter(**filters)
+
+    def get_values(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        return [item for item in value.split(',') if item]
+
+
+class StableOrderingFilter(OrderingFilter):
+    "OrderingFilter that always ends with the (created_at, id) tie-breaker."
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(super().get_ordering(request, queryset, view) or [])
+        for field in ('created_at', 'id'):
+            if field not in ordering and f'-{field}' not in ordering:
+                ordering.append(field)
+        return ordering
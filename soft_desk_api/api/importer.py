@@ -0,0 +1,273 @@
+"""
+Streaming import of tickets and comments from NDJSON.
+
+The input uses the layout written by ``api.export``: one JSON document per
+line with a ``type`` of ``ticket`` or ``comment``, tickets coming before
+their comments. Rows are buffered and written with ``bulk_create`` in
+fixed-size batches, one transaction per batch. Users and projects are
+resolved against in-memory id sets loaded once, and the source id of every
+imported ticket is mapped to its new id so comments can follow. Comments
+of a ticket still in the buffer wait for its flush to get their parent
+id, so batches keep their size on export output.
+"""
+import json
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import counters, etags, events, membership, stats
+from .models import Comment, Project, Ticket, User
+
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+TICKET_CHOICES = {
+    'priority': {choice for choice, _ in Ticket.PRIORITY_CHOICES},
+    'status': {choice for choice, _ in Ticket.STATUS_CHOICES},
+    'ticket_type': {choice for choice, _ in Ticket.TICKET_TYPE_CHOICES},
+}
+
+
+class ImportStats:
+    def __init__(self):
+        self.tickets = 0
+        self.comments = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line_number, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def as_dict(self):
+        seconds = time.perf_counter() - self.started
+        rows = self.tickets + self.comments
+        return {
+            'tickets': self.tickets,
+            'comments': self.comments,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else rows,
+        }
+
+
+class NDJSONImporter:
+    """
+    Import NDJSON lines into the database.
+
+    ``project`` forces every ticket into that project, otherwise the
+    ``project_id`` of each record must exist. ``default_user`` becomes the
+    affected user of tickets without one. Like the batch endpoint, the
+    affected user and the assignee must be contributors of the project.
+    """
+
+    def __init__(self, project=None, default_user=None, batch_size=BATCH_SIZE):
+        self.project_id = project.pk if project else None
+        self.default_user_id = default_user.pk if default_user else None
+        self.batch_size = batch_size
+        self.user_ids = set(User.objects.values_list('id', flat=True))
+        self.project_ids = (
+            {self.project_id} if project else set(Project.objects.values_list('id', flat=True)))
+        # Project id -> contributor ids, loaded once per project
+        self.contributor_ids = {}
+        # Source ticket id -> new ticket id, filled when the pending tickets are flushed
+        self.ticket_ids = {}
+        # New ticket id -> project id, copied to the comments of the ticket
+        self.ticket_projects = {}
+        self.pending_tickets = []
+        self.pending_source_ids = set()
+        self.pending_comments = []
+        # Source ticket id -> buffered comments of that ticket, while the ticket is buffered too
+        self.waiting_comments = {}
+        self.stats = ImportStats()
+
+    def run(self, lines):
+        for line_number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    self.stats.error(line_number, 'Invalid UTF-8.')
+                    continue
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.stats.error(line_number, 'Invalid JSON.')
+                continue
+            if not isinstance(record, dict):
+                self.stats.error(line_number, 'Expected a JSON object.')
+            elif record.get('type') == 'ticket':
+                self.add_ticket(line_number, record)
+            elif record.get('type') == 'comment':
+                self.add_comment(line_number, record)
+            else:
+                self.stats.error(line_number, 'Unknown record type.')
+        self.flush_tickets()
+        self.flush_comments()
+        return self.stats.as_dict()
+
+    def user_id(self, value):
+        return value if is_id(value) and value in self.user_ids else None
+
+    def is_contributor(self, user_id, project_id):
+        if project_id not in self.contributor_ids:
+            self.contributor_ids[project_id] = membership.get_project_contributor_ids(project_id)
+        return user_id in self.contributor_ids[project_id]
+
+    def add_ticket(self, line_number, record):
+        project_id = self.project_id or record.get('project_id')
+        affected_user_id = record.get('affected_user_id') or self.default_user_id
+        assigned_to_id = record.get('assigned_to_id')
+        # Valid JSON can still hold lists or objects where ids are expected
+        for field, value in [('id', record.get('id')), ('project_id', project_id),
+                             ('affected_user_id', affected_user_id), ('assigned_to_id', assigned_to_id)]:
+            if value is not None and not is_id(value):
+                return self.stats.error(line_number, f'Invalid {field}.')
+        if project_id not in self.project_ids:
+            return self.stats.error(line_number, 'Unknown project.')
+        if not affected_user_id:
+            return self.stats.error(line_number, 'Unknown affected user.')
+        # Unknown user ids are not contributors either
+        if not self.is_contributor(affected_user_id, project_id):
+            return self.stats.error(line_number, 'The affected user is not a project contributor.')
+        if assigned_to_id is not None and not self.is_contributor(assigned_to_id, project_id):
+            return self.stats.error(line_number, 'The assigned user is not a project contributor.')
+        if not record.get('title'):
+            return self.stats.error(line_number, 'A title is required.')
+        for field in ('title', 'details'):
+            if not isinstance(record.get(field) or '', str):
+                return self.stats.error(line_number, f'Invalid {field}.')
+        for field, choices in TICKET_CHOICES.items():
+            if field in record and not (isinstance(record[field], str) and record[field] in choices):
+                return self.stats.error(line_number, f'Invalid {field}.')
+        try:
+            created_at = parse_created_at(record)
+        except ValueError:
+            return self.stats.error(line_number, 'Invalid created_at.')
+
+        ticket = Ticket(
+            project_id=project_id,
+            affected_user_id=affected_user_id,
+            assigned_to_id=assigned_to_id,
+            title=record['title'][:200],
+            details=(record.get('details') or '')[:2000],
+            **{field: record[field] for field in TICKET_CHOICES if field in record},
+        )
+        self.pending_tickets.append((record.get('id'), ticket, created_at))
+        self.pending_source_ids.add(record.get('id'))
+        if len(self.pending_tickets) >= self.batch_size:
+            self.flush_tickets()
+
+    def add_comment(self, line_number, record):
+        source_ticket_id = record.get('parent_ticket_id')
+        if not is_id(source_ticket_id):
+            return self.stats.error(line_number, 'Unknown parent ticket.')
+        # A buffered parent ticket gets its id when it is flushed
+        buffered = source_ticket_id in self.pending_source_ids
+        ticket_id = self.ticket_ids.get(source_ticket_id)
+        if ticket_id is None and not buffered:
+            return self.stats.error(line_number, 'Unknown parent ticket.')
+        if not record.get('text'):
+            return self.stats.error(line_number, 'A text is required.')
+        for field in ('text', 'contributor_name'):
+            if not isinstance(record.get(field) or '', str):
+                return self.stats.error(line_number, f'Invalid {field}.')
+        try:
+            created_at = parse_created_at(record)
+        except ValueError:
+            return self.stats.error(line_number, 'Invalid created_at.')
+
+        comment = Comment(
+            parent_ticket_id=ticket_id,
+            contributor_id=self.user_id(record.get('contributor_id')),
+            contributor_name=record.get('contributor_name'),
+            text=record['text'][:500],
+        )
+        self.pending_comments.append((comment, created_at))
+        if buffered:
+            self.waiting_comments.setdefault(source_ticket_id, []).append(comment)
+        if len(self.pending_comments) >= self.batch_size:
+            self.flush_comments()
+
+    def flush_tickets(self):
+        if not self.pending_tickets:
+            return
+        tickets = [ticket for _, ticket, _ in self.pending_tickets]
+        with transaction.atomic():
+            Ticket.objects.bulk_create(tickets)
+            restore_created_at(
+                Ticket, [(ticket, created_at) for _, ticket, created_at in self.pending_tickets])
+            # Bulk writes do not send the model signals
+            counters.increment(Project, 'incidents_count', Counter(t.project_id for t in tickets))
+            stats.record_ticket_changes(tickets)
+            etags.bump(*[('project', project_id) for project_id in {t.project_id for t in tickets}])
+            for ticket in tickets:
+                events.publish(ticket.project_id, 'ticket.created', events.ticket_data(ticket))
+        for source_id, ticket, _ in self.pending_tickets:
+            self.ticket_projects[ticket.pk] = ticket.project_id
+            if source_id is not None:
+                self.ticket_ids[source_id] = ticket.pk
+                for comment in self.waiting_comments.pop(source_id, ()):
+                    comment.parent_ticket_id = ticket.pk
+        self.stats.tickets += len(tickets)
+        self.pending_tickets = []
+        self.pending_source_ids = set()
+
+    def flush_comments(self):
+        if not self.pending_comments:
+            return
+        if self.waiting_comments:
+            # Some parent tickets are still buffered
+            self.flush_tickets()
+        for comment, _ in self.pending_comments:
+            # bulk_create() does not call Comment.save()
+            comment.project_id = self.ticket_projects[comment.parent_ticket_id]
+        with transaction.atomic():
+            Comment.objects.bulk_create([comment for comment, _ in self.pending_comments])
+            restore_created_at(Comment, self.pending_comments)
+            counters.increment(Ticket, 'comment_count', Counter(
+                comment.parent_ticket_id for comment, _ in self.pending_comments))
+            ticket_ids = {comment.parent_ticket_id for comment, _ in self.pending_comments}
+            project_ids = {comment.project_id for comment, _ in self.pending_comments}
+            etags.bump(*[('ticket', ticket_id) for ticket_id in ticket_ids],
+                       *[('project', project_id) for project_id in project_ids])
+            for comment, _ in self.pending_comments:
+                events.publish(comment.project_id, 'comment.created', events.comment_data(comment))
+        self.stats.comments += len(self.pending_comments)
+        self.pending_comments = []
+
+
+def is_id(value):
+    # bool is a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_created_at(record):
+    "Return the created_at of a record, None when absent; ValueError when it is not a timestamp."
+    value = record.get('created_at')
+    if value is None:
+        return None
+    # parse_datetime() raises ValueError on out of range values, returns None on other formats
+    created_at = parse_datetime(value) if isinstance(value, str) else None
+    if created_at is None:
+        raise ValueError(value)
+    return created_at
+
+
+def restore_created_at(model, objects_with_dates):
+    # bulk_create applies auto_now_add, put back the original timestamps
+    dated = []
+    for obj, created_at in objects_with_dates:
+        if created_at is not None:
+            obj.created_at = created_at
+            dated.append(obj)
+    if dated:
+        model.objects.bulk_update(dated, ['created_at'])
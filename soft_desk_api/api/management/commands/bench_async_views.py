@@ -0,0 +1,111 @@
+import asyncio
+import statistics
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Project, Ticket
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of the sync read endpoints and their /api/async/ variants. '
+        'Requests are sent concurrently to the ASGI application of this process, '
+        'like a single ASGI worker, against the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='50,100,200,500',
+                            help='Comma-separated numbers of concurrent connections.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run.')
+        parser.add_argument('--project', type=int, help='Project to read, defaults to the largest one.')
+
+    def handle(self, *args, **options):
+        project = self.get_project(options['project'])
+        user = project.contributor.order_by('id').first() or project.creator
+        self.headers = [
+            (b'host', b'localhost'),
+            (b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode()),
+        ]
+        ticket = Ticket.objects.filter(project=project).order_by('id').first()
+        paths = {'ticket list': f'/project/{project.id}/ticket/'}
+        if ticket is not None:
+            paths['ticket detail'] = f'/project/{project.id}/ticket/{ticket.id}/'
+            paths['comment list'] = f'/project/{project.id}/ticket/{ticket.id}/comment/'
+
+        self.application = get_asgi_application()
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        self.stdout.write(f'{"endpoint":<15} {"conn":>5}  {"sync req/s":>10} {"p99 ms":>8}  '
+                          f'{"async req/s":>11} {"p99 ms":>8}  {"speedup":>7}')
+        for name, path in paths.items():
+            for concurrency in levels:
+                # Both sides serve cursor pages by default
+                sync = asyncio.run(self.run(f'/api{path}', '', concurrency, options['requests']))
+                async_ = asyncio.run(self.run(f'/api/async{path}', '', concurrency, options['requests']))
+                self.stdout.write(
+                    f'{name:<15} {concurrency:>5}  {sync[0]:>10.0f} {sync[1]:>8.1f}  '
+                    f'{async_[0]:>11.0f} {async_[1]:>8.1f}  {async_[0] / sync[0]:>6.2f}x')
+
+    def get_project(self, project_id):
+        if project_id is not None:
+            try:
+                return Project.objects.get(pk=project_id)
+            except Project.DoesNotExist:
+                raise CommandError(f'Project {project_id} not found.')
+        project = Project.objects.order_by('-incidents_count', 'id').first()
+        if project is None:
+            raise CommandError('The database has no project to read.')
+        return project
+
+    async def request(self, path, query_string):
+        "Send one GET through the ASGI application and return its status code."
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': query_string.encode(), 'root_path': '', 'headers': self.headers,
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        done = asyncio.Event()
+        sent_request = False
+        response = {}
+
+        async def receive():
+            nonlocal sent_request
+            if not sent_request:
+                sent_request = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Django listens for the client disconnecting while it answers
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif not message.get('more_body'):
+                done.set()
+
+        await self.application(scope, receive, send)
+        return response.get('status')
+
+    async def run(self, path, query_string, concurrency, total):
+        "Return (requests per second, p99 latency in ms) for one endpoint and concurrency."
+        latencies = []
+        remaining = total
+
+        async def connection():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                status = await self.request(path, query_string)
+                if status != 200:
+                    raise CommandError(f'GET {path} answered {status}.')
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(connection() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+        return total / elapsed, p99 * 1000
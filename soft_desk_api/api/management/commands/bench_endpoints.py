@@ -0,0 +1,93 @@
+import json
+import os
+import platform
+import tempfile
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from api import benchmarks
+from api.authentication import user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every API route on freshly seeded test databases of several sizes and write '
+        'a JSON report of p50/p99 latencies and SQL query counts. With --baseline, fail when a '
+        'route regressed against a previous report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000',
+                            help='Comma-separated numbers of tickets, e.g. 1000,100000,1000000.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route.')
+        parser.add_argument('--output', default='bench-report.json')
+        parser.add_argument('--baseline', help='Report to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative latency growth before a route is flagged.')
+        parser.add_argument('--min-ms', type=float, default=1.0,
+                            help='Latency growth below this many milliseconds is never flagged.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'requests': options['requests'],
+            'sizes': {},
+        }
+        setup_test_environment()
+        test_settings = connection.settings_dict['TEST']
+        test_name = test_settings['NAME']
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                for size in sizes:
+                    if connection.vendor == 'sqlite':
+                        # A file rather than the shared in-memory database, which
+                        # outlives destroy_test_db() and is timed without disk I/O
+                        test_settings['NAME'] = os.path.join(directory, f'bench-{size}.sqlite3')
+                    report['sizes'][str(size)] = self.bench_size(size, options['requests'])
+        finally:
+            test_settings['NAME'] = test_name
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(f"Report written to {options['output']}.")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = benchmarks.compare(
+                    report, json.load(baseline), options['tolerance'], options['min_ms'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regression against the baseline.'))
+
+    def bench_size(self, size, requests):
+        # A new test database per size, the configured database is never touched
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            cache.clear()
+            user_cache.clear()
+            start = time.perf_counter()
+            benchmarks.seed(size)
+            seed_seconds = time.perf_counter() - start
+            result = benchmarks.run(requests)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        result['seed_seconds'] = round(seed_seconds, 3)
+
+        self.stdout.write(f'{size} tickets (seeded in {seed_seconds:.1f}s)')
+        self.stdout.write(f'  {"route":<26} {"p50 ms":>9} {"p99 ms":>9} {"queries":>7}')
+        for name, case in result['cases'].items():
+            self.stdout.write(f"  {name:<26} {case['p50_ms']:>9.2f} {case['p99_ms']:>9.2f} {case['queries']:>7}")
+        if result['not_covered']:
+            self.stdout.write(self.style.WARNING(f"  Routes without a benchmark: {result['not_covered']}"))
+        return result
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.fastpath import FieldPlan
+from api.models import Project, Ticket, User
+from api.serializers import ProjectSerializer, TicketSerializer, UserSerializer
+
+
+SERIALIZERS = {
+    'ticket': (TicketSerializer, lambda: Ticket.objects.order_by('created_at', 'id')),
+    'project': (ProjectSerializer, lambda: Project.objects.order_by('id')),
+    'user': (UserSerializer, lambda: User.objects.order_by('id')),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the rows/sec of the list serializers (ModelSerializer) and of the values() '
+        'fast path, query included, on the rows of the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', default='10,100,500,1000')
+        parser.add_argument('--repeat', type=int, default=20, help='Pages serialized per measure.')
+        parser.add_argument('--serializer', choices=sorted(SERIALIZERS), action='append',
+                            help='Serializer to measure, all by default.')
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        self.stdout.write(f'{"serializer":<10} {"page":>5}  {"model rows/s":>12} {"values rows/s":>13}  {"speedup":>7}')
+        for name in options['serializer'] or sorted(SERIALIZERS):
+            serializer_class, queryset = SERIALIZERS[name]
+            plan = FieldPlan.compile(serializer_class())
+            if plan is None:
+                raise CommandError(f'{serializer_class.__name__} has no fast path.')
+            for size in page_sizes:
+                rows = queryset()[:size].count()
+                if not rows:
+                    raise CommandError(f'No {name} rows, seed the database first.')
+
+                def model_path():
+                    return serializer_class(list(queryset()[:size]), many=True).data
+
+                def values_path():
+                    return plan.to_representation(queryset().values(*plan.columns)[:size])
+
+                if model_path() != values_path():
+                    raise CommandError(f'{name}: the outputs differ.')
+                model_rate = self.measure(model_path, rows, options['repeat'])
+                values_rate = self.measure(values_path, rows, options['repeat'])
+                label = f'{size}' if rows == size else f'{rows}*'
+                self.stdout.write(
+                    f'{name:<10} {label:>5}  {model_rate:>12.0f} {values_rate:>13.0f}  '
+                    f'{values_rate / model_rate:>6.2f}x')
+        self.stdout.write('* fewer rows than the page size in the database')
+
+    def measure(self, serialize, rows, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            serialize()
+        return rows * repeat / (time.perf_counter() - start)
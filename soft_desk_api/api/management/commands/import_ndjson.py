@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import BATCH_SIZE, NDJSONImporter
+from api.models import Project, User
+
+
+class Command(BaseCommand):
+    help = 'Import tickets and comments from an NDJSON file (as written by the project export).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file to import, "-" reads the standard input.')
+        parser.add_argument('--project', type=int, help='Import every ticket into this project.')
+        parser.add_argument('--default-user', help='Username used when the affected user is unknown.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        project = default_user = None
+        if options['project']:
+            try:
+                project = Project.objects.get(pk=options['project'])
+            except Project.DoesNotExist:
+                raise CommandError(f'Project {options["project"]} not found.')
+        if options['default_user']:
+            try:
+                default_user = User.objects.get(username=options['default_user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User {options["default_user"]} not found.')
+
+        importer = NDJSONImporter(project, default_user, batch_size=options['batch_size'])
+        if options['path'] == '-':
+            stats = importer.run(sys.stdin)
+        else:
+            with open(options['path'], 'rb') as stream:
+                stats = importer.run(stream)
+
+        for error in stats['errors']:
+            self.stderr.write(f'Line {error["line"]}: {error["error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["tickets"]} tickets and {stats["comments"]} comments '
+            f'({stats["skipped"]} skipped) in {stats["seconds"]}s, '
+            f'{stats["rows_per_second"]} rows/s.'))
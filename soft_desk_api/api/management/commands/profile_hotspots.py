@@ -0,0 +1,80 @@
+import os
+import pstats
+import statistics
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import PROFILE_EXTENSIONS, parse_folded
+
+
+class Command(BaseCommand):
+    help = (
+        'Add up the hot spots of the request profiles written by RequestProfilingMiddleware: '
+        'cProfile dumps with pstats, sampler dumps by samples per function.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?', help='Profile directory, PROFILING_DIRECTORY by default.')
+        parser.add_argument('--view', help='Only the profiles of this view, e.g. TicketViewSet.')
+        parser.add_argument('--action', help='Only the profiles of this action, e.g. partial_update.')
+        parser.add_argument('--limit', type=int, default=25, help='Number of functions listed.')
+        parser.add_argument('--sort', choices=['cumulative', 'tottime'], default='cumulative',
+                            help='Time including the callees, or spent in the function itself.')
+        parser.add_argument('--strip-dirs', action='store_true', help='Show file names without their path.')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or settings.PROFILING_DIRECTORY
+        if not os.path.isdir(directory):
+            raise CommandError(f'{directory} does not exist.')
+        profiles = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(PROFILE_EXTENSIONS):
+                continue
+            # <time>-<view>-<action>-<duration>ms-<pid>.<extension>
+            parts = name.split('-')
+            if len(parts) != 5:
+                continue
+            _, view, action, duration, _ = parts
+            if options['view'] not in (None, view) or options['action'] not in (None, action):
+                continue
+            profiles.append((os.path.join(directory, name), int(duration[:-2])))
+        if not profiles:
+            raise CommandError(f'No matching profile in {directory}.')
+
+        durations = [duration for _, duration in profiles]
+        self.stdout.write(
+            f'{len(profiles)} profiles, {statistics.median(durations):.0f}ms median, {max(durations)}ms max')
+        dumps = [path for path, _ in profiles if path.endswith('.prof')]
+        if dumps:
+            self.print_cprofile(dumps, options)
+        folded = [path for path, _ in profiles if path.endswith('.folded')]
+        if folded:
+            self.print_samples(folded, options)
+
+    def print_cprofile(self, paths, options):
+        self.stdout.write(f'\ncProfile, {len(paths)} profiles')
+        stats = pstats.Stats(*paths, stream=self.stdout)
+        if options['strip_dirs']:
+            stats.strip_dirs()
+        stats.sort_stats(options['sort']).print_stats(options['limit'])
+
+    def print_samples(self, paths, options):
+        inclusive = Counter()
+        own = Counter()
+        total = 0
+        for path in paths:
+            for stack, count in parse_folded(path).items():
+                total += count
+                own[stack[-1]] += count
+                # A recursive function counts once per sample
+                for frame in set(stack):
+                    inclusive[frame] += count
+        self.stdout.write(f'\nSampler, {len(paths)} profiles, {total} samples')
+        self.stdout.write(f'{"total %":>8} {"self %":>8}  function')
+        ranking = inclusive if options['sort'] == 'cumulative' else own
+        for frame, _ in ranking.most_common(options['limit']):
+            label = os.path.basename(frame) if options['strip_dirs'] else frame
+            self.stdout.write(
+                f'{inclusive[frame] * 100 / total:>8.1f} {own[frame] * 100 / total:>8.1f}  {label}')
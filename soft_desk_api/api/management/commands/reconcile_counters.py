@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api import counters, stats
+from api.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Repair the denormalized incidents_count and comment_count counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--summary', action='store_true', help='Also rebuild the ticket summary table.')
+
+    def handle(self, *args, **options):
+        for (model, field) in counters.COUNTERS:
+            repaired = sum(counters.reconcile(model, field, options['batch_size']))
+            self.stdout.write(f'{model.__name__}.{field}: {repaired} rows repaired.')
+
+        if options['summary']:
+            project_ids = list(Project.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(project_ids), options['batch_size']):
+                stats.rebuild_summary(project_ids[start:start + options['batch_size']])
+            self.stdout.write(f'Ticket summary rebuilt for {len(project_ids)} projects.')
+
+        self.stdout.write(self.style.SUCCESS('Counters reconciled.'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import User
+from api.seeding import BATCH_SIZE, seed
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with synthetic users, projects, contributors, tickets and comments '
+        'for load tests: a few huge projects, a long tail of small ones and heavy commenters.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--projects', type=int, default=100)
+        parser.add_argument('--tickets', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument('--huge-projects', type=int, default=3,
+                            help='Projects sharing half of the tickets.')
+        parser.add_argument('--password', default='password', help='Password of every generated user.')
+        parser.add_argument('--prefix', default='seed', help='Prefix of the usernames and project names.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data sets.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['projects'] < 1:
+            raise CommandError('At least one user and one project are required.')
+        if min(options['tickets'], options['comments'], options['huge_projects']) < 0:
+            raise CommandError('The sizes cannot be negative.')
+        if User.objects.filter(username__startswith=f'{options["prefix"]}-').exists():
+            raise CommandError(f'Users named {options["prefix"]}-* already exist, choose another --prefix.')
+
+        def progress(rows):
+            if self.verbosity > 1:
+                self.stdout.write(f'{rows["tickets"]} tickets, {rows["comments"]} comments')
+
+        self.verbosity = options['verbosity']
+        stats = seed(
+            options['users'], options['projects'], options['tickets'], options['comments'],
+            huge_projects=options['huge_projects'], password=options['password'], prefix=options['prefix'],
+            seed=options['seed'], batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {stats["users"]} users, {stats["projects"]} projects, {stats["contributors"]} '
+            f'contributors, {stats["tickets"]} tickets and {stats["comments"]} comments in '
+            f'{stats["seconds"]}s, {stats["rows_per_second"]} rows/s.'))
@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api import db_routers
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the replication heartbeat on the primary database and copy the primary '
+        'to the SQLite replicas listed in DATABASE_REPLICAS. Replicas on other engines '
+        'are expected to replicate the heartbeat themselves.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Repeat every INTERVAL seconds instead of running once.')
+
+    def handle(self, *args, **options):
+        for alias in settings.DATABASE_REPLICAS:
+            if alias not in connections:
+                raise CommandError(f'Replica {alias!r} is not in DATABASES.')
+        while True:
+            self.sync()
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self):
+        db_routers.write_heartbeat()
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+                continue
+            primary.ensure_connection()
+            # The backup API copies a consistent snapshot, readers of the
+            # replica only wait for the final page swap
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'Copied {DEFAULT_DB_ALIAS} to {alias}.')
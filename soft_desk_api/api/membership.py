@@ -0,0 +1,139 @@
+"""
+Project membership lookups backed by the contributor through table.
+
+The project ids of each user are cached in the ``MEMBERSHIP_CACHE`` cache,
+invalidated when the contributors change. Without a cache shared by every
+worker process, the invalidation would only reach the worker making the
+change: membership is then read with an indexed EXISTS query per check.
+"""
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+from .caching import shared_cache
+from .models import Project, User
+
+
+# Through table of Project.contributor, indexed on (project_id, user_id)
+Contributor = Project.contributor.through
+
+CACHE_KEY = 'membership:user:{}'
+CACHE_TIMEOUT = 60 * 60
+
+
+def contributor_exists(user_id, project_id):
+    "Check membership with an indexed EXISTS query on the through table."
+    return Contributor.objects.filter(project_id=project_id, user_id=user_id).exists()
+
+
+def get_project_contributor_ids(project_id):
+    "Return the ids of the contributors of a project."
+    return set(Contributor.objects.filter(project_id=project_id).values_list('user_id', flat=True))
+
+
+def get_cache():
+    "The cache holding the project ids of the users, None when it is private to the process."
+    return shared_cache(settings.MEMBERSHIP_CACHE)
+
+
+def get_user_project_ids(user_id):
+    "Return the ids of the projects a user contributes to, cached per user."
+    cache = get_cache()
+    key = CACHE_KEY.format(user_id)
+    project_ids = cache.get(key) if cache is not None else None
+    if project_ids is None:
+        # Read from the primary: a lagging replica would be cached for the whole timeout
+        project_ids = frozenset(Contributor.objects.using(router.db_for_write(Contributor)).filter(
+            user_id=user_id).values_list('project_id', flat=True))
+        if cache is not None:
+            cache.set(key, project_ids, CACHE_TIMEOUT)
+    return project_ids
+
+
+async def aget_user_project_ids(user_id):
+    "Async get_user_project_ids()."
+    cache = get_cache()
+    key = CACHE_KEY.format(user_id)
+    project_ids = await cache.aget(key) if cache is not None else None
+    if project_ids is None:
+        project_ids = frozenset([
+            project_id async for project_id in
+            Contributor.objects.using(router.db_for_write(Contributor)).filter(
+                user_id=user_id).values_list('project_id', flat=True)])
+        if cache is not None:
+            await cache.aset(key, project_ids, CACHE_TIMEOUT)
+    return project_ids
+
+
+def is_project_contributor(user, project_id):
+    "Return True when the user is registered to the project."
+    if not user or not user.is_authenticated:
+        return False
+    try:
+        project_id = int(project_id)
+    except (TypeError, ValueError):
+        return False
+    if get_cache() is None:
+        # Live check: each worker would hold its own stale copy of the project ids
+        return contributor_exists(user.pk, project_id)
+    return project_id in get_user_project_ids(user.pk)
+
+
+async def ais_project_contributor(user, project_id):
+    "Async is_project_contributor()."
+    if not user or not user.is_authenticated:
+        return False
+    try:
+        project_id = int(project_id)
+    except (TypeError, ValueError):
+        return False
+    if get_cache() is None:
+        return await Contributor.objects.filter(project_id=project_id, user_id=user.pk).aexists()
+    return project_id in await aget_user_project_ids(user.pk)
+
+
+def invalidate_users(user_ids):
+    "Drop the cached project ids of the given users."
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def _send_m2m_changed(action, project, pk_set):
+    # Bulk writes on the through table bypass the related manager, send its signals ourselves
+    m2m_changed.send(
+        sender=Contributor, instance=project, action=action, reverse=False,
+        model=User, pk_set=pk_set, using=project._state.db)
+
+
+def update_contributors(project, add=(), remove=(), replace=None):
+    """
+    Apply a set of contributor changes to a project.
+
+    The current contributors are read with a single query, the difference is
+    computed in Python and applied with one bulk INSERT and one DELETE on the
+    through table. When ``replace`` is given, the contributors become exactly
+    that set of user ids. Returns the sets of added and removed user ids.
+    """
+    with transaction.atomic():
+        # Read in the transaction applying the changes; a user added meanwhile by a
+        # concurrent request is skipped by the INSERT instead of failing on the unique key
+        existing = get_project_contributor_ids(project.pk)
+        if replace is not None:
+            to_add = set(replace) - existing
+            to_remove = existing - set(replace)
+        else:
+            to_add = set(add) - existing
+            to_remove = set(remove) & existing
+
+        if to_add:
+            _send_m2m_changed('pre_add', project, to_add)
+            Contributor.objects.bulk_create([
+                Contributor(project_id=project.pk, user_id=user_id) for user_id in to_add
+            ], ignore_conflicts=True)
+            _send_m2m_changed('post_add', project, to_add)
+        if to_remove:
+            _send_m2m_changed('pre_remove', project, to_remove)
+            Contributor.objects.filter(project_id=project.pk, user_id__in=to_remove).delete()
+            _send_m2m_changed('post_remove', project, to_remove)
+    return to_add, to_remove
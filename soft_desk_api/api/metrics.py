@@ -0,0 +1,207 @@
+"""
+Request metrics in the Prometheus text format, without an external collector.
+
+MetricsMiddleware counts the requests by viewset, action, method and
+status, and records the latency and the SQL time of each request in
+histograms by viewset and action. The JWT user cache reports its hits and
+misses.
+
+Each worker process keeps its metrics in memory and writes them, at most
+every ``METRICS_FLUSH_INTERVAL`` seconds, to its own JSON file in
+``METRICS_DIRECTORY``. ``/api/metrics/`` adds up the files of every
+process, so whichever worker serves the scrape returns the totals. The
+files of stopped workers are kept so the counters never go back; clear
+the directory when deploying.
+
+The endpoint reveals the routes and the traffic of the API: outside DEBUG
+it is only served when ``METRICS_TOKEN`` is set, to scrapes sending it.
+"""
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .authentication import user_cache
+
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Any other method is counted as "other": clients choose the method, each new one would be a new series
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'])
+
+METRICS = {
+    'softdesk_http_requests_total': (
+        'counter', 'Requests by viewset, action, method and status code.'),
+    'softdesk_http_request_duration_seconds': (
+        'histogram', 'Request latency by viewset and action.'),
+    'softdesk_http_request_db_seconds': (
+        'histogram', 'Time spent in SQL queries per request, by viewset and action.'),
+    'softdesk_db_queries_total': (
+        'counter', 'SQL queries by viewset and action.'),
+    'softdesk_auth_cache_hits_total': (
+        'counter', 'JWT authentications served from the user cache.'),
+    'softdesk_auth_cache_misses_total': (
+        'counter', 'JWT authentications that loaded the user from the database.'),
+}
+
+
+class Registry:
+    "Metrics of the current process."
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # The random part keeps a later process reusing the pid from overwriting the file
+        self.filename = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        # (name, labels) -> value
+        self.counters = defaultdict(float)
+        # (name, labels) -> [count per bucket..., count over the last bucket, sum]
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def check_fork(self):
+        # A worker forked from a process with metrics starts from zero, in its own file
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.check_fork()
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            self.check_fork()
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [0] * (len(BUCKETS) + 2)
+            histogram[bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()]
+        # Counted by the user cache itself, per process
+        for name, value in [('softdesk_auth_cache_hits_total', user_cache.hits),
+                            ('softdesk_auth_cache_misses_total', user_cache.misses)]:
+            counters.append([name, [], value])
+        return {'counters': counters, 'histograms': histograms}
+
+    def flush(self, force=False):
+        "Write the metrics of the process to its file, at most every METRICS_FLUSH_INTERVAL."
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        directory = settings.METRICS_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+        data = self.snapshot()
+        # Written aside then renamed: readers never see a partial file
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as output:
+            json.dump(data, output)
+        os.replace(path, os.path.join(directory, self.filename))
+
+
+registry = Registry()
+
+
+def observe_request(view, action, method, status, seconds, queries=None):
+    if method not in METHODS:
+        # Its action is named after the method too
+        method = action = 'other'
+    labels = (('viewset', view), ('action', action))
+    registry.inc('softdesk_http_requests_total', labels + (('method', method), ('status', str(status))))
+    registry.observe('softdesk_http_request_duration_seconds', labels, seconds)
+    if queries is not None:
+        registry.inc('softdesk_db_queries_total', labels, queries.count)
+        registry.observe('softdesk_http_request_db_seconds', labels, queries.seconds)
+    registry.flush()
+
+
+def collect():
+    "Add up the metric files of every process: ({(name, labels): value}, {(name, labels): values})."
+    counters = defaultdict(float)
+    histograms = {}
+    directory = settings.METRICS_DIRECTORY
+    names = [name for name in os.listdir(directory) if name.endswith('.json')] if os.path.isdir(directory) else []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as metrics_file:
+                data = json.load(metrics_file)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in data['counters']:
+            counters[(metric, tuple(map(tuple, labels)))] += value
+        for metric, labels, values in data['histograms']:
+            key = (metric, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = values
+    return counters, histograms
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(counters, histograms):
+    "Prometheus text exposition format 0.0.4."
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{format_labels(labels)} {format_value(value)}')
+            continue
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            # Buckets are cumulative in the exposition format
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), values[:-1]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{metric}_sum{format_labels(labels)} {format_value(values[-1])}')
+            lines.append(f'{metric}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    "Metrics of every worker process, for a Prometheus scrape."
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not settings.METRICS_TOKEN:
+        # Open to anyone: only while developing
+        if not settings.DEBUG:
+            raise Http404
+    elif request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponse('Unauthorized.\n', status=401, content_type='text/plain')
+    # This process' latest requests are included in the totals
+    registry.flush(force=True)
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,267 @@
+"""
+Per-request instrumentation: SQL queries and on-demand profiling.
+
+QueryInstrumentationMiddleware counts the queries of every request, their
+total time and the statements run more than once with the same
+parameters, and returns them in a ``Server-Timing`` header that the
+browser developer tools display next to the request. Queries slower than
+``SLOW_QUERY_MS`` and requests slower than ``SLOW_REQUEST_MS`` are written
+as JSON lines to the ``api.slow`` logger.
+
+The queries are recorded by an execute wrapper installed on every
+database connection when it is opened (see ApiConfig.ready), into the
+statistics of the current request held in a context variable: queries
+run by the async views in the sync_to_async threads are counted too. With ``QUERY_INSTRUMENTATION = False`` the
+middleware is not loaded and no wrapper is installed.
+
+RequestProfilingMiddleware runs single views under a profiler, see
+api/profiling.py. MetricsMiddleware feeds the Prometheus metrics of
+api/metrics.py.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from . import metrics, profiling
+from .authentication import CachedJWTAuthentication
+
+
+slow_log = logging.getLogger('api.slow')
+
+# Length of the SQL written to the slow log
+MAX_LOGGED_SQL = 2000
+
+# Statistics of the queries of the current request, None outside requests
+_current = contextvars.ContextVar('query_stats', default=None)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.duplicate_seconds = 0.0
+        self.statements = Counter()
+        self.slow = []
+
+    @property
+    def duplicates(self):
+        "Number of queries repeating an earlier statement with the same parameters."
+        return sum(count - 1 for count in self.statements.values())
+
+    def add(self, alias, sql, params, seconds):
+        self.count += 1
+        self.seconds += seconds
+        key = (sql, repr(params))
+        self.statements[key] += 1
+        if self.statements[key] > 1:
+            self.duplicate_seconds += seconds
+        if seconds * 1000 >= settings.SLOW_QUERY_MS:
+            self.slow.append({'alias': alias, 'duration_ms': round(seconds * 1000, 3), 'sql': sql[:MAX_LOGGED_SQL]})
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(context['connection'].alias, sql, params, time.perf_counter() - start)
+
+
+def install_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextlib.contextmanager
+def track_queries():
+    "Record the queries run inside the block, in every thread it hands work to."
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def request_queries():
+    "The query statistics of the current request, tracked here when no outer block does."
+    stats = _current.get()
+    if stats is not None:
+        yield stats
+        return
+    with track_queries() as stats:
+        yield stats
+
+
+def server_timing(stats, seconds):
+    db_ms = stats.seconds * 1000
+    total_ms = seconds * 1000
+    return ', '.join([
+        f'db;dur={db_ms:.1f};desc="{stats.count} queries"',
+        f'db-dup;dur={stats.duplicate_seconds * 1000:.1f};desc="{stats.duplicates} duplicate queries"',
+        # Everything else: authentication, permissions, serialization, rendering
+        f'app;dur={max(total_ms - db_ms, 0):.1f}',
+        f'total;dur={total_ms:.1f}',
+    ])
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with track_queries() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with track_queries() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, seconds):
+        response['Server-Timing'] = server_timing(stats, seconds)
+        if stats.slow or seconds * 1000 >= settings.SLOW_REQUEST_MS:
+            entry = {
+                'method': request.method,
+                'path': request.path,
+                'view': request.resolver_match.view_name if request.resolver_match else None,
+                'status': response.status_code,
+            }
+            for query in stats.slow:
+                slow_log.warning(json.dumps({'event': 'slow_query', **entry, **query}))
+            if seconds * 1000 >= settings.SLOW_REQUEST_MS:
+                duplicated = [sql[:MAX_LOGGED_SQL] for (sql, _), count in stats.statements.most_common(3) if count > 1]
+                slow_log.warning(json.dumps({
+                    'event': 'slow_request', **entry,
+                    'duration_ms': round(seconds * 1000, 3),
+                    'db_ms': round(stats.seconds * 1000, 3),
+                    'queries': stats.count,
+                    'duplicates': stats.duplicates,
+                    'duplicated_sql': duplicated,
+                }))
+        return response
+
+
+def view_labels(request, view_func):
+    "Return the view class (or URL name) and the action of a request, for the profile names."
+    view_class = getattr(view_func, 'cls', None)
+    view = view_class.__name__ if view_class else request.resolver_match.view_name
+    method = request.method.lower()
+    # Viewsets map each HTTP method to an action: partial_update, stats...
+    actions = getattr(view_func, 'actions', None) or {}
+    return view, actions.get(method, method)
+
+
+def is_superuser(request):
+    if request.user.is_superuser:
+        return True
+    # The API authenticates with JWT in the views: check the token here
+    try:
+        result = CachedJWTAuthentication().authenticate(Request(request))
+    except APIException:
+        return False
+    return bool(result and result[0].is_superuser)
+
+
+class RequestProfilingMiddleware(MiddlewareMixin):
+    """
+    Run the view under a profiler when a superuser sends ``X-Profile:
+    cprofile`` or ``X-Profile: sampler``, or for a sampled share of the
+    requests. Must come last: the other middleware run before the view.
+    """
+
+    def requested_mode(self, request):
+        requested = request.headers.get('X-Profile')
+        if requested:
+            if not is_superuser(request):
+                return None
+            return requested if requested in profiling.PROFILERS else settings.PROFILING_MODE
+        if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+            return settings.PROFILING_MODE
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Async views share the event loop with other requests: their profile would mix them
+        if iscoroutinefunction(view_func):
+            return None
+        mode = self.requested_mode(request)
+        if mode is None:
+            return None
+
+        profiler = profiling.PROFILERS[mode]()
+        start = time.perf_counter()
+        with profiler:
+            response = view_func(request, *view_args, **view_kwargs)
+            # Rendering is part of the cost of the view: DRF renders the data after it returns
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        seconds = time.perf_counter() - start
+        name = profiling.save(profiler, *view_labels(request, view_func), seconds)
+        if 'X-Profile' in request.headers:
+            response['X-Profile-File'] = name
+        return response
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with request_queries() as queries:
+            response = self.get_response(request)
+        self.observe(request, response, queries, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with request_queries() as queries:
+            response = await self.get_response(request)
+        self.observe(request, response, queries, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, queries, seconds):
+        if request.resolver_match is None:
+            # Unknown URL: one series for all of them
+            view, action = 'none', 'none'
+        else:
+            view, action = view_labels(request, request.resolver_match.func)
+        metrics.observe_request(view, action, request.method, response.status_code, seconds, queries)
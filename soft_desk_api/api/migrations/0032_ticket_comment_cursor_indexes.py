@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_alter_ticket_assigned_to'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent_ticket', 'created_at', 'id'], name='comment_ticket_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'created_at', 'id'], name='ticket_project_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_ticket_comment_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'status', 'priority', 'created_at'], name='ticket_project_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'priority', 'created_at'], name='ticket_project_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'ticket_type', 'created_at'], name='ticket_project_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'assigned_to', 'created_at'], name='ticket_project_assigned_idx'),
+        ),
+    ]
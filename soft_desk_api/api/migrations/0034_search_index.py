@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+# FTS5 index over ticket title/details and comment text, see api/search.py.
+# Tickets are stored at rowid 2 * id and comments at rowid 2 * id + 1.
+# The triggers keeping it in sync are installed by search.install_triggers()
+# after every migrate: SQLite drops them whenever Django rebuilds a table.
+FORWARD_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_search_index USING fts5(
+        ticket_id UNINDEXED, scope, title, body,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    # Index the existing rows
+    """
+    INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+    SELECT id * 2, id, 'p' || project_id, title, details FROM api_ticket
+    """,
+    """
+    INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+    SELECT c.id * 2 + 1, c.parent_ticket_id, 'p' || t.project_id, '', c.text
+    FROM api_comment c JOIN api_ticket t ON t.id = c.parent_ticket_id
+    """,
+]
+
+REVERSE_SQL = [
+    'DROP TRIGGER IF EXISTS api_search_ticket_insert',
+    'DROP TRIGGER IF EXISTS api_search_ticket_update',
+    'DROP TRIGGER IF EXISTS api_search_ticket_delete',
+    'DROP TRIGGER IF EXISTS api_search_comment_insert',
+    'DROP TRIGGER IF EXISTS api_search_comment_update',
+    'DROP TRIGGER IF EXISTS api_search_comment_delete',
+    'DROP TABLE IF EXISTS api_search_index',
+]
+
+
+def run_sql(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is SQLite specific, other backends use the icontains fallback
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_ticket_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(REVERSE_SQL)),
+    ]
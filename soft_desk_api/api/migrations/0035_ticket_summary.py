@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_summary(apps, schema_editor):
+    Ticket = apps.get_model('api', 'Ticket')
+    TicketSummary = apps.get_model('api', 'TicketSummary')
+    rows = Ticket.objects.values(
+        'project_id', 'status', 'priority', 'ticket_type', 'assigned_to_id'
+    ).annotate(count=models.Count('id')).order_by()
+    TicketSummary.objects.bulk_create([
+        TicketSummary(
+            project_id=row['project_id'], status=row['status'], priority=row['priority'],
+            ticket_type=row['ticket_type'], assigned_to=row['assigned_to_id'] or 0, count=row['count'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=15)),
+                ('priority', models.CharField(max_length=10)),
+                ('ticket_type', models.CharField(max_length=20)),
+                ('assigned_to', models.PositiveBigIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_summary', to='api.project')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('project', 'status', 'priority', 'ticket_type', 'assigned_to'), name='unique_ticket_summary')],
+            },
+        ),
+        migrations.RunPython(populate_summary, migrations.RunPython.noop),
+    ]
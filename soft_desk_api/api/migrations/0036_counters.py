@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Project = apps.get_model('api', 'Project')
+    Ticket = apps.get_model('api', 'Ticket')
+    Comment = apps.get_model('api', 'Comment')
+    for model, counted, foreign_key, field in (
+        (Project, Ticket, 'project', 'incidents_count'),
+        (Ticket, Comment, 'parent_ticket', 'comment_count'),
+    ):
+        count = Subquery(
+            counted.objects.filter(**{foreign_key: OuterRef('pk')})
+            .order_by().values(foreign_key).annotate(count=Count('pk')).values('count'))
+        model.objects.update(**{field: Coalesce(count, Value(0))})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_ticket_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='incidents_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_project(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+    Ticket = apps.get_model('api', 'Ticket')
+    # One UPDATE: the project of each comment is the project of its ticket
+    Comment.objects.update(project_id=models.Subquery(
+        Ticket.objects.filter(pk=models.OuterRef('parent_ticket_id')).values('project_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_replica_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='project',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.project'),
+        ),
+        migrations.RunPython(populate_project, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='comment',
+            name='project',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.project'),
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['project', 'updated_at', 'id'], name='comment_project_updated_idx'),
+        ),
+    ]
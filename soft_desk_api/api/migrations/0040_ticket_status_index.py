@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_comment_project'),
+    ]
+
+    operations = [
+        migrations.RenameIndex(
+            model_name='ticket',
+            new_name='ticket_project_status_prio_idx',
+            old_name='ticket_project_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'status', 'created_at'], name='ticket_project_status_idx'),
+        ),
+    ]
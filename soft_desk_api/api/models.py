@@ -1,7 +1,23 @@
 "Third-party imports (Django)"
 from django.contrib.auth.models import AbstractUser, Group, Permission
-from django.db import models
+from django.db import models, router, transaction
 from django.core.validators import MinValueValidator
+
+
+class CounterFieldsMixin:
+    "Leave the counter columns out of the UPDATE of an existing row."
+
+    # Counter columns, only ever changed with F() updates (see api/counters.py)
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        # Saving an instance loaded before a counter changed must not write back its stale value
+        if not self._state.adding and kwargs.get('update_fields') is None and not args:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
   
 
 class User(AbstractUser):
@@ -17,7 +33,7 @@ class User(AbstractUser):
         return f"User ID: {self.id} - Username: {self.username}"
 
 
-class Project(models.Model):
+class Project(CounterFieldsMixin, models.Model):
     "A model representing a Project in the system."
 
     creator = models.ForeignKey(User, on_delete=models.PROTECT, related_name='created_project')
@@ -26,6 +42,9 @@ class Project(models.Model):
     contributor = models.ManyToManyField(User, blank=True, related_name='contributed_project',
         verbose_name="Users registered to this project")
     created_at = models.DateTimeField(auto_now_add=True)
+    incidents_count = models.IntegerField(default=0, editable=False)
+
+    counter_fields = ('incidents_count',)
 
     BACKEND = 'Backend Project'
     FRONTEND = 'Frontend Project'
@@ -44,17 +63,21 @@ class Project(models.Model):
         choices=project_type
     )
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        for user in self.contributor.all():
-            if not self in user.contributed_project.all():
-                user.projects.add(self)
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(Project, instance=self)
+        with transaction.atomic(using=using):
+            # The receivers of the ticket and comment deletions keep counters, tombstones and
+            # ETags of the project up to date: with them the cascade would load every row and
+            # run several queries per row. The project goes away, remove the rows in bulk first.
+            Comment.objects.using(using).filter(project_id=self.pk)._raw_delete(using)
+            Ticket.objects.using(using).filter(project_id=self.pk)._raw_delete(using)
+            return super().delete(using=using, keep_parents=keep_parents)
 
     def __str__(self):
         return self.name
 
 
-class Ticket(models.Model):
+class Ticket(CounterFieldsMixin, models.Model):
     # Relationships
     affected_user = models.ForeignKey("User", on_delete=models.CASCADE)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='incidents')
@@ -70,6 +93,10 @@ class Ticket(models.Model):
     title = models.CharField(max_length=200)
     details = models.CharField(max_length=2000)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    comment_count = models.IntegerField(default=0, editable=False)
+
+    counter_fields = ('comment_count',)
 
     # Constants for choices
     HIGH = 'high'
@@ -122,6 +149,29 @@ class Ticket(models.Model):
         default=TASK
     )
 
+    class Meta:
+        indexes = [
+            # Cursor pagination of the tickets of a project
+            models.Index(fields=['project', 'created_at', 'id'], name='ticket_project_created_idx'),
+            # Server-side filtering of the tickets of a project: each filter is followed
+            # by created_at so that the index also serves the default sort
+            models.Index(fields=['project', 'status', 'created_at'], name='ticket_project_status_idx'),
+            models.Index(
+                fields=['project', 'status', 'priority', 'created_at'], name='ticket_project_status_prio_idx'),
+            models.Index(fields=['project', 'priority', 'created_at'], name='ticket_project_priority_idx'),
+            models.Index(fields=['project', 'ticket_type', 'created_at'], name='ticket_project_type_idx'),
+            models.Index(fields=['project', 'assigned_to', 'created_at'], name='ticket_project_assigned_idx'),
+            # Delta sync of the tickets of a project
+            models.Index(fields=['project', 'updated_at', 'id'], name='ticket_project_updated_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values: the signal receivers compare them on save
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         return self.title
 
@@ -133,14 +183,87 @@ class Comment(models.Model):
     contributor_name = models.CharField(max_length=200, blank=True, null=True, editable=False)
     text = models.CharField(max_length=500)
     parent_ticket = models.ForeignKey("Ticket", on_delete=models.CASCADE)
+    # Copy of parent_ticket.project_id: the delta sync reads the comments of a project
+    # in (updated_at, id) order from one index, without joining the tickets
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Cursor pagination of the comments of a ticket
+            models.Index(fields=['parent_ticket', 'created_at', 'id'], name='comment_ticket_created_idx'),
+            # Delta sync of the comments of a project
+            models.Index(fields=['project', 'updated_at', 'id'], name='comment_project_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.contributor_name and self.contributor:
             self.contributor_name = self.contributor.name
+        if self.project_id is None:
+            # The project of a ticket never changes
+            self.project_id = self.parent_ticket.project_id
 
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Comment by {self.contributor_name if self.contributor_name else 'Unknown'}"
-    
\ No newline at end of file
+    
+
+
+class Tombstone(models.Model):
+    "A record of a deleted ticket or comment, read by the delta sync API."
+
+    TICKET = 'ticket'
+    COMMENT = 'comment'
+
+    KIND_CHOICES = [
+        (TICKET, 'Ticket'),
+        (COMMENT, 'Comment'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # Plain ids: the rows they pointed to are gone or about to be
+    project_id = models.BigIntegerField()
+    ticket_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project_id', 'deleted_at', 'id'], name='tombstone_project_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+
+class TicketSummary(models.Model):
+    "Number of tickets of a project for each status/priority/type/assignee, maintained incrementally."
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='ticket_summary')
+    status = models.CharField(max_length=15)
+    priority = models.CharField(max_length=10)
+    ticket_type = models.CharField(max_length=20)
+    # 0 for unassigned tickets: NULL values would not be covered by the unique constraint
+    assigned_to = models.PositiveBigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['project', 'status', 'priority', 'ticket_type', 'assigned_to'],
+                name='unique_ticket_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.project_id}: {self.status}/{self.priority}/{self.ticket_type} = {self.count}"
+
+
+class ReplicaHeartbeat(models.Model):
+    "Single row updated on the primary database: its age on a replica is the replication lag."
+
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat_at}"
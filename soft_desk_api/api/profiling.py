@@ -0,0 +1,127 @@
+"""
+Profiling of single requests on live traffic.
+
+RequestProfilingMiddleware runs a view under a profiler when a superuser
+sends an ``X-Profile`` header, or for a random ``PROFILING_SAMPLE_RATE``
+share of the requests. Two profilers are available:
+
+- ``cprofile``: deterministic, every Python call of the view, written as
+  a ``.prof`` file readable by pstats or snakeviz;
+- ``sampler``: a thread records the stack of the request every
+  ``PROFILING_SAMPLER_INTERVAL`` seconds, written as a ``.folded`` file
+  (one ``frame;frame;frame count`` line per stack, the input of
+  flamegraph tools). Its overhead does not depend on the number of calls.
+
+Files are written to ``PROFILING_DIRECTORY``, named after the time, the
+view, the action and the duration, and only the most recent
+``PROFILING_MAX_FILES`` are kept. ``manage.py profile_hotspots`` adds up
+the hot spots of the collected files.
+"""
+import cProfile
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+
+PROFILE_EXTENSIONS = ('.prof', '.folded')
+
+
+def frame_label(code):
+    # Same format as pstats: filename:lineno(function)
+    return f'{code.co_filename}:{code.co_firstlineno}({code.co_name})'
+
+
+class CProfiler:
+    extension = '.prof'
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+
+
+class Sampler:
+    extension = '.folded'
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.PROFILING_SAMPLER_INTERVAL
+        self.samples = Counter()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name='request-sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as output:
+            for stack, count in self.samples.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+PROFILERS = {'cprofile': CProfiler, 'sampler': Sampler}
+
+
+def profile_filename(view, action, seconds, extension):
+    "Sortable name of a profile: time, view, action, duration and process."
+    label = '-'.join(re.sub(r'[^\w.]+', '_', part) for part in (view, action))
+    return (f'{timezone.now():%Y%m%dT%H%M%S_%f}-{label}-{round(seconds * 1000)}ms-'
+            f'{os.getpid()}{extension}')
+
+
+def prune(directory, max_files):
+    "Remove the oldest profiles beyond ``max_files``."
+    names = sorted(name for name in os.listdir(directory) if name.endswith(PROFILE_EXTENSIONS))
+    for name in names[:max(len(names) - max_files, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Already removed by another worker
+            pass
+
+
+def save(profiler, view, action, seconds):
+    "Write the profile to the profile directory and return its file name."
+    directory = settings.PROFILING_DIRECTORY
+    os.makedirs(directory, exist_ok=True)
+    name = profile_filename(view, action, seconds, profiler.extension)
+    profiler.dump(os.path.join(directory, name))
+    prune(directory, settings.PROFILING_MAX_FILES)
+    return name
+
+
+def parse_folded(path):
+    "Return the samples of a .folded file as {stack tuple: count}."
+    samples = Counter()
+    with open(path) as folded:
+        for line in folded:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                samples[tuple(stack.split(';'))] += int(count)
+    return samples
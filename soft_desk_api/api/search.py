@@ -0,0 +1,175 @@
+"""
+Full-text search over the tickets and comments of a project.
+
+On SQLite the text is indexed in the ``api_search_index`` FTS5 table, kept
+in sync by triggers (the table is created by migration 0034). Tickets are stored at rowid
+``2 * id`` and comments at ``2 * id + 1``; the ``scope`` column holds a
+``p<project id>`` token so the project filter is part of the MATCH.
+Other database backends fall back to ``icontains`` lookups.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+
+from .models import Comment, Ticket
+
+
+SNIPPET_TOKENS = 12
+# Columns of api_search_index: ticket_id, scope, title, body
+TITLE_COLUMN = 2
+BODY_COLUMN = 3
+
+TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_ticket_insert AFTER INSERT ON api_ticket BEGIN
+        INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+        VALUES (new.id * 2, new.id, 'p' || new.project_id, new.title, new.details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_ticket_update
+    AFTER UPDATE OF title, details, project_id ON api_ticket BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 2;
+        INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+        VALUES (new.id * 2, new.id, 'p' || new.project_id, new.title, new.details);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_ticket_delete AFTER DELETE ON api_ticket BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_comment_insert AFTER INSERT ON api_comment BEGIN
+        INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+        SELECT new.id * 2 + 1, new.parent_ticket_id, 'p' || project_id, '', new.text
+        FROM api_ticket WHERE id = new.parent_ticket_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_comment_update
+    AFTER UPDATE OF text, parent_ticket_id ON api_comment BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 2 + 1;
+        INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+        SELECT new.id * 2 + 1, new.parent_ticket_id, 'p' || project_id, '', new.text
+        FROM api_ticket WHERE id = new.parent_ticket_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS api_search_comment_delete AFTER DELETE ON api_comment BEGIN
+        DELETE FROM api_search_index WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+]
+
+REBUILD_SQL = [
+    'DELETE FROM api_search_index',
+    """
+    INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+    SELECT id * 2, id, 'p' || project_id, title, details FROM api_ticket
+    """,
+    """
+    INSERT INTO api_search_index(rowid, ticket_id, scope, title, body)
+    SELECT c.id * 2 + 1, c.parent_ticket_id, 'p' || t.project_id, '', c.text
+    FROM api_comment c JOIN api_ticket t ON t.id = c.parent_ticket_id
+    """,
+    "INSERT INTO api_search_index(api_search_index) VALUES ('optimize')",
+]
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match(project_id, query):
+    "Turn free text into a safe FTS5 query: every word is a quoted prefix term."
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    words = ' '.join(f'"{term}"*' for term in terms)
+    return f'scope : "p{int(project_id)}" AND {{title body}} : ({words})'
+
+
+def search_project(project_id, query, limit=20):
+    "Return the best matching tickets and comments of a project, best first."
+    if not is_available():
+        return _search_fallback(project_id, query, limit)
+
+    match = build_match(project_id, query)
+    if match is None:
+        return []
+    # With column -1 FTS5 would pick the scope column, which always matches the
+    # project token: the snippet comes from the title when it matched, else the body
+    title = f"snippet(api_search_index, {TITLE_COLUMN}, '<mark>', '</mark>', '…', %s)"
+    body = f"snippet(api_search_index, {BODY_COLUMN}, '<mark>', '</mark>', '…', %s)"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid, ticket_id,
+                   CASE WHEN instr({title}, '<mark>') THEN {title} ELSE {body} END,
+                   bm25(api_search_index, 0.0, 0.0, 10.0, 1.0) AS score
+            FROM api_search_index
+            WHERE api_search_index MATCH %s
+            ORDER BY score
+            LIMIT %s
+            """,
+            [SNIPPET_TOKENS] * 3 + [match, limit],
+        )
+        rows = cursor.fetchall()
+    return [
+        {
+            'type': 'comment' if rowid % 2 else 'ticket',
+            'id': rowid // 2,
+            'ticket_id': ticket_id,
+            'snippet': snippet,
+            'rank': round(-score, 6),
+        }
+        for rowid, ticket_id, snippet, score in rows
+    ]
+
+
+def _search_fallback(project_id, query, limit):
+    # Unranked substring search for database backends without FTS5
+    tickets = Ticket.objects.filter(project_id=project_id).filter(
+        Q(title__icontains=query) | Q(details__icontains=query)).values('id', 'title')[:limit]
+    comments = Comment.objects.filter(
+        project_id=project_id, text__icontains=query
+    ).values('id', 'parent_ticket_id', 'text')[:limit]
+    results = [
+        {'type': 'ticket', 'id': t['id'], 'ticket_id': t['id'], 'snippet': t['title'], 'rank': 0}
+        for t in tickets
+    ] + [
+        {'type': 'comment', 'id': c['id'], 'ticket_id': c['parent_ticket_id'], 'snippet': c['text'], 'rank': 0}
+        for c in comments
+    ]
+    return results[:limit]
+
+
+def install_triggers(using='default'):
+    "Create the triggers keeping the index in sync, if the index table exists."
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'api_search_index'")
+        if cursor.fetchone() is None:
+            return
+        for sql in TRIGGERS_SQL:
+            cursor.execute(sql)
+
+
+def drop_triggers(using='default'):
+    "Drop the index triggers, before a bulk load followed by rebuild_index()."
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'api_search_%'")
+        for name, in cursor.fetchall():
+            cursor.execute(f'DROP TRIGGER {name}')
+
+
+def rebuild_index():
+    "Rebuild the FTS5 index from the ticket and comment tables."
+    with connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+        cursor.execute('SELECT count(*) FROM api_search_index')
+        return cursor.fetchone()[0]
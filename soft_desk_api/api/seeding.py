@@ -0,0 +1,260 @@
+"""
+Fast generation of synthetic users, projects, tickets and comments.
+
+Everything is written in bulk: no model ``save()`` and no signal runs,
+the password is hashed once for every user and the contributor links go
+straight into the through table. Users, projects and links go through
+``bulk_create``; tickets and comments, the bulk of the rows, are inserted
+as plain tuples. The counters the
+signals would maintain are computed while generating and written with the
+rows; the ticket summary and the full-text index are rebuilt at the end.
+
+The data is skewed like real trackers: a few huge projects hold a large
+share of the tickets, project sizes follow a long tail, and a minority of
+users write most of the comments.
+"""
+import datetime
+import itertools
+import random
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import search, stats
+from .membership import Contributor
+from .models import Comment, Project, Ticket, User
+
+
+BATCH_SIZE = 5000
+# Share of the tickets going to the huge projects
+HUGE_PROJECTS_SHARE = 0.5
+# Pareto shapes: lower is more skewed
+PROJECT_SIZE_SHAPE = 1.2
+COMMENTER_SHAPE = 1.16
+TICKET_ACTIVITY_SHAPE = 1.5
+
+WORDS = (
+    'login', 'export', 'dashboard', 'payment', 'search', 'upload', 'profile', 'report',
+    'notification', 'sync', 'cache', 'timeout', 'crash', 'layout', 'permission', 'email',
+)
+# (value, weight): most tickets end up resolved, few are urgent
+PRIORITIES = ((Ticket.LOW, 6), (Ticket.MEDIUM, 3), (Ticket.HIGH, 1))
+STATUSES = ((Ticket.RESOLVED, 6), (Ticket.IN_PROGRESS, 3), (Ticket.ON_HOLD, 1))
+TICKET_TYPES = ((Ticket.BUG, 5), (Ticket.TASK, 4), (Ticket.IMPROVEMENT, 2))
+PROJECT_TYPES = [choice for choice, _ in Project.project_type]
+HISTORY_DAYS = 365
+TEXT_POOL_SIZE = 1000
+
+TICKET_COLUMNS = (
+    'id', 'project_id', 'affected_user_id', 'assigned_to_id', 'title', 'details',
+    'priority', 'status', 'ticket_type', 'comment_count', 'created_at', 'updated_at',
+)
+COMMENT_COLUMNS = (
+    'parent_ticket_id', 'project_id', 'contributor_id', 'contributor_name', 'text', 'created_at', 'updated_at',
+)
+
+
+def _weighted(rng, choices, k):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights, k=k)
+
+
+def _insert(model, columns, rows):
+    # bulk_create prepares every value through its field and is capped by the SQLite
+    # parameter limit: for the large tables, plain executemany() is several times faster
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table), ', '.join(map(quote, columns)), ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _shares(total, parts):
+    "Split ``total`` into ``parts`` integers differing by at most one."
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+class SeedStats:
+    def __init__(self):
+        self.rows = Counter()
+        self.started = time.perf_counter()
+
+    def as_dict(self):
+        seconds = time.perf_counter() - self.started
+        rows = sum(self.rows.values())
+        return {
+            **{model: self.rows[model] for model in ('users', 'projects', 'contributors', 'tickets', 'comments')},
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds) if seconds else rows,
+        }
+
+
+class Seeder:
+    """
+    Generate a data set of the given sizes.
+
+    Usernames and project names start with ``prefix``; ``seed`` makes the
+    output reproducible. ``progress`` is called with the running totals
+    after every batch of tickets.
+    """
+
+    def __init__(self, users, projects, tickets, comments, huge_projects=1, password='password',
+                 prefix='seed', seed=0, batch_size=BATCH_SIZE, progress=None):
+        self.sizes = {'users': users, 'projects': projects, 'tickets': tickets, 'comments': comments}
+        self.huge_projects = min(huge_projects, projects)
+        self.password = password
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = SeedStats()
+        # Joining random words for every row is a large part of the generation time
+        self.texts = [' '.join(self.rng.choices(WORDS, k=12)) for _ in range(TEXT_POOL_SIZE)]
+
+    def run(self):
+        # The FTS triggers would index every row on insert: one rebuild at the end is faster
+        if search.is_available():
+            search.drop_triggers()
+        try:
+            self.create_users()
+            self.create_projects()
+            self.create_contributors()
+            self.create_tickets()
+        finally:
+            if search.is_available():
+                search.install_triggers()
+                search.rebuild_index()
+        stats.rebuild_summary()
+        return self.stats.as_dict()
+
+    def create_users(self):
+        # PBKDF2 takes tens of milliseconds: every user shares the same hash
+        password = make_password(self.password)
+        users = User.objects.bulk_create([
+            User(username=f'{self.prefix}-{i}', email=f'{self.prefix}-{i}@example.com', password=password)
+            for i in range(self.sizes['users'])
+        ], batch_size=self.batch_size)
+        self.user_ids = [user.pk for user in users]
+        self.usernames = {user.pk: user.username for user in users}
+        # Comment activity of each user: a few heavy commenters write most comments
+        self.activity = {
+            user_id: self.rng.paretovariate(COMMENTER_SHAPE) for user_id in self.user_ids}
+        self.stats.rows['users'] = len(users)
+
+    def create_projects(self):
+        rng = self.rng
+        count = self.sizes['projects']
+        # Ticket counts: the huge projects split their share, the others follow a long tail
+        if not self.huge_projects:
+            huge_tickets = 0
+        elif count > self.huge_projects:
+            huge_tickets = round(self.sizes['tickets'] * HUGE_PROJECTS_SHARE)
+        else:
+            huge_tickets = self.sizes['tickets']
+        sizes = _shares(huge_tickets, self.huge_projects) if self.huge_projects else []
+        tail = [rng.paretovariate(PROJECT_SIZE_SHAPE) for _ in range(count - self.huge_projects)]
+        if tail:
+            allocation = Counter(rng.choices(range(len(tail)), tail, k=self.sizes['tickets'] - huge_tickets))
+            sizes += [allocation[i] for i in range(len(tail))]
+        self.ticket_counts = sizes
+
+        projects = Project.objects.bulk_create([
+            Project(
+                creator_id=rng.choice(self.user_ids), name=f'{self.prefix}-{i}',
+                description=f'Synthetic project {i}', type=rng.choice(PROJECT_TYPES),
+                # Counter written with the row, as the signals would have maintained it
+                incidents_count=sizes[i])
+            for i in range(count)
+        ], batch_size=self.batch_size)
+        self.project_ids = [project.pk for project in projects]
+        self.creators = [project.creator_id for project in projects]
+        self.stats.rows['projects'] = len(projects)
+
+    def create_contributors(self):
+        rng = self.rng
+        self.members = []
+        links = []
+        for i, project_id in enumerate(self.project_ids):
+            if i < self.huge_projects:
+                size = max(200, len(self.user_ids) // 2)
+            else:
+                size = max(3, min(200, self.ticket_counts[i] // 10))
+            members = set(rng.sample(self.user_ids, min(size, len(self.user_ids))))
+            members.add(self.creators[i])
+            members = sorted(members)
+            self.members.append(members)
+            links.extend(Contributor(project_id=project_id, user_id=user_id) for user_id in members)
+        # Straight into the through table: project.contributor.add() would send m2m_changed per project
+        Contributor.objects.bulk_create(links, batch_size=self.batch_size)
+        self.stats.rows['contributors'] = len(links)
+        # Weighted choice of the author of a comment among the project members
+        self.commenter_weights = [
+            list(itertools.accumulate(self.activity[user_id] for user_id in members))
+            for members in self.members
+        ]
+
+    def create_tickets(self):
+        rng = self.rng
+        total = self.sizes['tickets']
+        # Project index of every ticket, shuffled so the ids of a project are interleaved
+        projects = [i for i, count in enumerate(self.ticket_counts) for _ in range(count)]
+        rng.shuffle(projects)
+        # Ids are assigned here so the comments can reference their ticket without reading it back
+        next_id = (Ticket.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        # Creation dates spread over the last year in id order, as the live tables would be
+        now = timezone.now()
+        step = datetime.timedelta(days=HISTORY_DAYS) / max(total, 1)
+        adapt = connection.ops.adapt_datetimefield_value
+        comments_done = 0
+        for start in range(0, total, self.batch_size):
+            batch = projects[start:start + self.batch_size]
+            # Comments of the batch in proportion, concentrated on a few busy tickets
+            comments = round(self.sizes['comments'] * (start + len(batch)) / total) - comments_done
+            comments_done += comments
+            heat = [rng.paretovariate(TICKET_ACTIVITY_SHAPE) for _ in batch]
+            comment_counts = Counter(rng.choices(range(len(batch)), heat, k=comments))
+
+            priorities = _weighted(rng, PRIORITIES, len(batch))
+            statuses = _weighted(rng, STATUSES, len(batch))
+            types = _weighted(rng, TICKET_TYPES, len(batch))
+            tickets = []
+            comments = []
+            for n, project in enumerate(batch):
+                members = self.members[project]
+                ticket_id = next_id + start + n
+                created_at = adapt(now - step * (total - start - n))
+                tickets.append((
+                    ticket_id, self.project_ids[project], rng.choice(members),
+                    rng.choice(members) if rng.random() < 0.8 else None,
+                    f'{rng.choice(WORDS)} {rng.choice(WORDS)} issue {start + n}',
+                    rng.choice(self.texts),
+                    priorities[n], statuses[n], types[n], comment_counts[n], created_at, created_at))
+                if comment_counts[n]:
+                    authors = rng.choices(members, cum_weights=self.commenter_weights[project], k=comment_counts[n])
+                    comments.extend(
+                        (ticket_id, self.project_ids[project], author, self.usernames[author], rng.choice(self.texts),
+                         created_at, created_at)
+                        for author in authors)
+
+            with transaction.atomic():
+                _insert(Ticket, TICKET_COLUMNS, tickets)
+                _insert(Comment, COMMENT_COLUMNS, comments)
+            self.stats.rows['tickets'] += len(tickets)
+            self.stats.rows['comments'] += len(comments)
+            if self.progress:
+                self.progress(self.stats.rows)
+
+        # Explicit ids leave the sequences behind on PostgreSQL and Oracle
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Ticket, Comment]):
+                cursor.execute(sql)
+
+
+def seed(users, projects, tickets, comments, **options):
+    "Generate a data set, see Seeder. Returns the row counts and the throughput."
+    return Seeder(users, projects, tickets, comments, **options).run()
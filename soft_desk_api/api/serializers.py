@@ -1,28 +1,92 @@
 from rest_framework.serializers import ModelSerializer
 from rest_framework import serializers
 
+from . import membership
 from .models import User, Project, Ticket, Comment
 
 
-class UserSerializer(ModelSerializer):
+def split_param(value):
+    if value is None:
+        return None
+    return {item for item in value.split(',') if item}
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets and opt-in expansion for GET requests.
+
+    ``?fields=id,title`` renders only those fields of the top-level
+    serializer. Once ``?expand=`` is given, only the relations it lists
+    are rendered as nested objects, the others as primary keys. Without
+    the parameters the output is unchanged.
+    """
+
+    def is_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD') or not self.is_root():
+            return fields
+
+        expandable = [name for name, field in fields.items() if isinstance(field, serializers.BaseSerializer)]
+        requested = split_param(request.query_params.get('fields'))
+        if requested is not None:
+            readable = [name for name, field in fields.items() if not field.write_only]
+            unknown = requested - set(readable)
+            if unknown:
+                raise serializers.ValidationError(
+                    {'fields': f'Unknown fields {sorted(unknown)}, choose from {readable}.'})
+            fields = {name: field for name, field in fields.items() if name in requested}
+
+        expand = split_param(request.query_params.get('expand'))
+        if expand is not None:
+            unknown = expand - set(expandable)
+            if unknown:
+                raise serializers.ValidationError(
+                    {'expand': f'Cannot expand {sorted(unknown)}, choose from {expandable}.'})
+            for name in expandable:
+                if name in fields and name not in expand:
+                    field = fields[name]
+                    fields[name] = serializers.PrimaryKeyRelatedField(
+                        read_only=True, source=field.source,
+                        many=isinstance(field, serializers.ListSerializer))
+        return fields
+
+
+def rendered_relations(serializer):
+    "Return {source: nested} for the relations the serializer renders, nested or as primary keys."
+    relations = {}
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.BaseSerializer):
+            relations[field.source] = True
+        elif isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField)):
+            relations.setdefault(field.source, False)
+    return relations
+
+
+class UserSerializer(DynamicFieldsMixin, ModelSerializer):
 
     class Meta:
         model = User
         fields = ['id', 'username']
 
 
-class ProjectSerializer(ModelSerializer):
+class ProjectSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = Project
-        fields = ['id', 'name']
+        fields = ['id', 'name', 'incidents_count']
 
     
-class ProjectDetailSerializer(ModelSerializer):
+class ProjectDetailSerializer(DynamicFieldsMixin, ModelSerializer):
     
     contributor = serializers.PrimaryKeyRelatedField(many=True, queryset=User.objects.all(), write_only=True)
     # For reading contributor details (with full user information)
     contributors = UserSerializer(many=True, read_only=True, source='contributor')    
-    incidents_count = serializers.SerializerMethodField()  # Custom field to show only the number of incidents
     creator = serializers.PrimaryKeyRelatedField(read_only=True)
     creator_detail = UserSerializer(read_only=True, source='creator')
 
@@ -40,10 +104,6 @@ class ProjectDetailSerializer(ModelSerializer):
                   'contributors']
 
 
-    def get_incidents_count(self, obj):
-        # Return the count of incidents (related tickets) for the project
-        return obj.incidents.count()
-    
     def validate_name(self, value):
         # Normalize value to lowercase to ensure consistency in storage
         normalized_value = value.lower()
@@ -56,16 +116,28 @@ class ProjectDetailSerializer(ModelSerializer):
         # Handle contributors separately to avoid overwriting
         new_contributors = validated_data.pop('contributor', [])
 
-        # For each contributor in the new list, add them if not already a contributor
-        for contributor in new_contributors:
-            if contributor not in instance.contributor.all():
-                instance.contributor.add(contributor)  # Append new contributors
+        # Add the new contributors that are not already registered in one bulk insert
+        membership.update_contributors(instance, add=[contributor.pk for contributor in new_contributors])
 
         # Call the default update method for other fields
         return super().update(instance, validated_data)
 
 
-class UserDetailSerializer(ModelSerializer):
+class ContributorChangeSerializer(serializers.Serializer):
+    # List of user ids to add, remove or set as the contributors of a project
+    contributors = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=10000)
+
+    def validate_contributors(self, value):
+        user_ids = set(value)
+        # Check every user exists with a single query
+        found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        missing = sorted(user_ids - found)
+        if missing:
+            raise serializers.ValidationError(f'Users not found: {missing}')
+        return user_ids
+
+
+class UserDetailSerializer(DynamicFieldsMixin, ModelSerializer):
     
     contributed_project = ProjectSerializer(many=True, read_only=True)
 
@@ -90,7 +162,7 @@ class UserDetailSerializer(ModelSerializer):
         read_only_fields = ['is_active']  # Ensures that is_active is only read-only
 
 
-class TicketDetailSerializer(ModelSerializer):
+class TicketDetailSerializer(DynamicFieldsMixin, ModelSerializer):
 
     affected_user = UserSerializer(read_only=True)
     assigned_to = UserSerializer(read_only=True)
@@ -108,17 +180,29 @@ class TicketDetailSerializer(ModelSerializer):
                   'priority',
                   'status',
                   'ticket_type',
+                  'comment_count',
                   ]
 
 
-class TicketSerializer(ModelSerializer):
+class TicketSerializer(DynamicFieldsMixin, ModelSerializer):
+
+    class Meta:
+        model = Ticket
+        fields = ['id', 'title', 'comment_count']
+
+
+class TicketBatchItemSerializer(ModelSerializer):
+    # Items with an id update that ticket, the others create a new ticket
+    id = serializers.IntegerField(required=False, min_value=1)
+    # Plain id: the assignees of the whole batch are checked with a single query by the view
+    assigned_to = serializers.IntegerField(required=False, allow_null=True, min_value=1)
 
     class Meta:
         model = Ticket
-        fields = ['id', 'title']
+        fields = ['id', 'title', 'details', 'priority', 'status', 'ticket_type', 'assigned_to']
 
 
-class CommentSerializer(ModelSerializer):
+class CommentSerializer(DynamicFieldsMixin, ModelSerializer):
 
     contributor = UserSerializer(read_only=True)
     parent_ticket = TicketSerializer(read_only=True)
@@ -0,0 +1,151 @@
+"Signal receivers keeping derived data in sync with the models."
+
+from django.db import connections
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import counters, etags, events, membership, search, stats
+from .authentication import user_cache
+from .models import Comment, Project, Ticket, Tombstone, User
+
+
+@receiver(m2m_changed, sender=Project.contributor.through)
+def invalidate_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.contributed_project was changed: only this user is affected
+        membership.invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        # pk_set is not provided on clear, collect the users before they are removed
+        membership.invalidate_users(
+            sender.objects.filter(project_id=instance.pk).values_list('user_id', flat=True))
+    else:
+        membership.invalidate_users(pk_set)
+
+
+@receiver(m2m_changed, sender=Project.contributor.through)
+def bump_contributors_etag(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        etags.bump(('project', instance.pk))
+        return
+    if action == 'pre_clear':
+        pk_set = sender.objects.filter(user_id=instance.pk).values_list('project_id', flat=True)
+    etags.bump(*[('project', project_id) for project_id in pk_set])
+
+
+@receiver(pre_delete, sender=Project)
+def invalidate_project_membership(sender, instance, **kwargs):
+    # Deleting a project removes its through rows without sending m2m_changed
+    membership.invalidate_users(instance.contributor.values_list('id', flat=True))
+
+
+@receiver(post_migrate)
+def install_search_triggers(sender, using, **kwargs):
+    # SQLite drops the triggers of a table when a migration rebuilds it
+    if sender.name == 'api' and connections[using].vendor == 'sqlite':
+        search.install_triggers(using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers profile updates, deactivation and password changes
+    user_cache.delete(instance.pk)
+    etags.bump(etags.USERS)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def bump_project_etag(sender, instance, **kwargs):
+    etags.bump(('project', instance.pk))
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def bump_ticket_etag(sender, instance, **kwargs):
+    # The ticket list and the incidents count of the project change too
+    etags.bump(('ticket', instance.pk), ('project', instance.project_id))
+
+
+@receiver(post_save, sender=Ticket)
+def publish_ticket_event(sender, instance, created, raw=False, **kwargs):
+    # Connected before update_ticket_summary, which replaces the loaded values
+    if raw:
+        return
+    data = events.ticket_data(instance)
+    if created:
+        events.publish(instance.project_id, 'ticket.created', data)
+        return
+    events.publish(instance.project_id, 'ticket.updated', data)
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded and 'assigned_to_id' in loaded and loaded['assigned_to_id'] != instance.assigned_to_id:
+        events.publish(instance.project_id, 'ticket.assigned', data)
+
+
+@receiver(post_save, sender=Ticket)
+def update_ticket_summary(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.record_ticket_changes([instance])
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_from_ticket_summary(sender, instance, **kwargs):
+    stats.record_ticket_changes([instance], deleted=True)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_etag(sender, instance, **kwargs):
+    # The ticket list of the project shows the comment count of each ticket
+    etags.bump(('ticket', instance.parent_ticket_id), ('project', instance.project_id))
+
+
+@receiver(post_save, sender=Ticket)
+def increment_incidents_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment(Project, 'incidents_count', {instance.project_id: 1})
+
+
+@receiver(post_delete, sender=Ticket)
+def decrement_incidents_count(sender, instance, **kwargs):
+    counters.increment(Project, 'incidents_count', {instance.project_id: -1})
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment(Ticket, 'comment_count', {instance.parent_ticket_id: 1})
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    counters.increment(Ticket, 'comment_count', {instance.parent_ticket_id: -1})
+
+
+@receiver(post_delete, sender=Ticket)
+def record_ticket_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        kind=Tombstone.TICKET, object_id=instance.pk,
+        project_id=instance.project_id, ticket_id=instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+def record_comment_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        kind=Tombstone.COMMENT, object_id=instance.pk,
+        project_id=instance.project_id, ticket_id=instance.parent_ticket_id)
+
+
+@receiver(post_delete, sender=Project)
+def delete_project_tombstones(sender, instance, **kwargs):
+    # Tombstones are not tied to the project by a foreign key, the cascade above recorded them
+    Tombstone.objects.filter(project_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        events.publish(instance.project_id, 'comment.created', events.comment_data(instance))
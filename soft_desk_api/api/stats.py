@@ -0,0 +1,132 @@
+"""
+Ticket breakdowns of a project.
+
+The live statistics come from a single GROUP BY over the tickets of the
+project. For very large projects the same rows can be read from
+TicketSummary, a table of counters updated by the ticket signal receivers
+(and by the bulk write paths through ``record_ticket_changes``).
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Ticket, TicketSummary
+
+
+KEY_FIELDS = ('project_id', 'status', 'priority', 'ticket_type', 'assigned_to_id')
+
+
+def summary_key(values):
+    "Return the summary row key of a ticket from a dict of its field values."
+    if not all(field in values for field in KEY_FIELDS):
+        return None
+    project_id, status, priority, ticket_type, assigned_to_id = (values[f] for f in KEY_FIELDS)
+    return project_id, status, priority, ticket_type, assigned_to_id or 0
+
+
+def record_ticket_changes(tickets, deleted=False):
+    """
+    Update the summary for saved (or deleted) ticket instances.
+
+    The previous key of a ticket is read from the values it was loaded with
+    (Ticket.from_db); tickets created in this process have none.
+    """
+    deltas = Counter()
+    for ticket in tickets:
+        loaded = getattr(ticket, '_loaded_values', None)
+        old_key = summary_key(loaded) if loaded is not None else None
+        if loaded is not None and old_key is None:
+            # Loaded with deferred fields: read the stored values
+            old_key = summary_key(Ticket.objects.filter(pk=ticket.pk).values(*KEY_FIELDS).first() or {})
+        new_key = None if deleted else summary_key(ticket.__dict__)
+        if old_key != new_key:
+            if old_key is not None:
+                deltas[old_key] -= 1
+            if new_key is not None:
+                deltas[new_key] += 1
+        ticket._loaded_values = None if deleted else {f: ticket.__dict__[f] for f in KEY_FIELDS}
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    "Add each delta to its summary row with an atomic F() update, creating missing rows first."
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Missing rows are created empty in one statement, existing ones are left untouched.
+    # Decrements never create rows: they may come from the deletion of the project.
+    TicketSummary.objects.bulk_create([
+        TicketSummary(project_id=project_id, status=status, priority=priority,
+                      ticket_type=ticket_type, assigned_to=assigned_to, count=0)
+        for (project_id, status, priority, ticket_type, assigned_to), delta in deltas.items()
+        if delta > 0
+    ], ignore_conflicts=True)
+    for (project_id, status, priority, ticket_type, assigned_to), delta in deltas.items():
+        TicketSummary.objects.filter(
+            project_id=project_id, status=status, priority=priority,
+            ticket_type=ticket_type, assigned_to=assigned_to,
+        ).update(count=F('count') + delta)
+
+
+def rebuild_summary(project_ids=None):
+    "Recompute the summary rows of the given projects (all projects by default)."
+    tickets = Ticket.objects.all()
+    summary = TicketSummary.objects.all()
+    if project_ids is not None:
+        tickets = tickets.filter(project_id__in=project_ids)
+        summary = summary.filter(project_id__in=project_ids)
+    rows = tickets.values(*KEY_FIELDS).annotate(count=Count('id')).order_by()
+    with transaction.atomic():
+        summary.delete()
+        TicketSummary.objects.bulk_create([
+            TicketSummary(
+                project_id=row['project_id'], status=row['status'], priority=row['priority'],
+                ticket_type=row['ticket_type'], assigned_to=row['assigned_to_id'] or 0,
+                count=row['count'])
+            for row in rows
+        ], batch_size=1000)
+
+
+def _live_rows(project_id):
+    return (
+        Ticket.objects.filter(project_id=project_id)
+        .values('status', 'priority', 'ticket_type', 'assigned_to')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+
+
+def _summary_rows(project_id):
+    return TicketSummary.objects.filter(project_id=project_id, count__gt=0).values(
+        'status', 'priority', 'ticket_type', 'assigned_to', 'count')
+
+
+def project_stats(project_id, source='live'):
+    "Return the ticket counts of a project by status, priority, type and open tickets per assignee."
+    rows = _summary_rows(project_id) if source == 'summary' else _live_rows(project_id)
+    by_status = dict.fromkeys((choice for choice, _ in Ticket.STATUS_CHOICES), 0)
+    by_priority = dict.fromkeys((choice for choice, _ in Ticket.PRIORITY_CHOICES), 0)
+    by_ticket_type = dict.fromkeys((choice for choice, _ in Ticket.TICKET_TYPE_CHOICES), 0)
+    open_by_assignee = Counter()
+    total = 0
+    for row in rows:
+        count = row['count']
+        total += count
+        by_status[row['status']] = by_status.get(row['status'], 0) + count
+        by_priority[row['priority']] = by_priority.get(row['priority'], 0) + count
+        by_ticket_type[row['ticket_type']] = by_ticket_type.get(row['ticket_type'], 0) + count
+        if row['status'] != Ticket.RESOLVED:
+            open_by_assignee[row['assigned_to'] or None] += count
+    return {
+        'source': source,
+        'total': total,
+        'by_status': by_status,
+        'by_priority': by_priority,
+        'by_ticket_type': by_ticket_type,
+        'open_by_assignee': [
+            {'assigned_to': assigned_to, 'count': count}
+            for assigned_to, count in sorted(
+                open_by_assignee.items(), key=lambda item: (-item[1], item[0] or 0))
+        ],
+    }
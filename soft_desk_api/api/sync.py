@@ -0,0 +1,102 @@
+"""
+Delta sync of the tickets and comments of a project.
+
+Tickets, comments and tombstones (deleted rows) are each read in
+``(updated_at, id)`` order from the position stored in an opaque cursor,
+so a sync only reads the rows changed since the previous one. Rows
+changed in the last ``SYNC_SETTLE_SECONDS`` are held back: a transaction
+that started earlier may still commit a smaller timestamp.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .export import COMMENT_FIELDS, TICKET_FIELDS
+from .models import Comment, Ticket, Tombstone
+
+
+STREAMS = {
+    # name: (queryset factory, timestamp field, values)
+    'tickets': (
+        lambda project_id: Ticket.objects.filter(project_id=project_id),
+        'updated_at', TICKET_FIELDS + ['updated_at'],
+    ),
+    'comments': (
+        lambda project_id: Comment.objects.filter(project_id=project_id),
+        'updated_at', COMMENT_FIELDS + ['updated_at'],
+    ),
+    'deleted': (
+        lambda project_id: Tombstone.objects.filter(project_id=project_id),
+        'deleted_at', ['id', 'kind', 'object_id', 'ticket_id', 'deleted_at'],
+    ),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(positions):
+    data = json.dumps(positions, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(cursor):
+    "Return {stream: (timestamp, id)} from a cursor, an empty dict for a full sync."
+    if not cursor:
+        return {}
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        decoded = {}
+        for stream in STREAMS:
+            if stream not in positions:
+                continue
+            timestamp, last_id = positions[stream]
+            timestamp = parse_datetime(timestamp)
+            # parse_datetime() returns None for a string that is not a timestamp
+            if timestamp is None or type(last_id) is not int:
+                raise InvalidCursor('Invalid cursor.')
+            decoded[stream] = (timestamp, last_id)
+        return decoded
+    except (ValueError, TypeError, KeyError, IndexError, binascii.Error):
+        raise InvalidCursor('Invalid cursor.')
+
+
+def changes_since(project_id, cursor=None, limit=100):
+    """
+    Return the rows of the project changed after the cursor, at most ``limit`` per stream.
+
+    The response holds the new cursor to send back and ``has_more`` when a
+    stream was cut at the limit.
+    """
+    positions = decode_cursor(cursor)
+    settled = timezone.now() - datetime.timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    result = {}
+    has_more = False
+    new_positions = {}
+    for stream, (queryset_for, timestamp_field, fields) in STREAMS.items():
+        queryset = queryset_for(project_id).filter(**{f'{timestamp_field}__lte': settled})
+        position = positions.get(stream)
+        if position is not None:
+            timestamp, last_id = position
+            queryset = queryset.filter(
+                Q(**{f'{timestamp_field}__gt': timestamp})
+                | Q(**{timestamp_field: timestamp, 'id__gt': last_id}))
+        rows = list(queryset.order_by(timestamp_field, 'id').values(*fields)[:limit + 1])
+        if len(rows) > limit:
+            rows = rows[:limit]
+            has_more = True
+        result[stream] = rows
+        if rows:
+            position = (rows[-1][timestamp_field], rows[-1]['id'])
+        if position is not None:
+            new_positions[stream] = [position[0].isoformat(), position[1]]
+    result['cursor'] = encode_cursor(new_positions)
+    result['has_more'] = has_more
+    return result
@@ -0,0 +1,24 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import metrics
+
+
+class TestRunner(DiscoverRunner):
+    "Test runner writing the metrics of the test requests to a temporary directory."
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # Every request of the suite goes through MetricsMiddleware: keep its files
+        # out of the METRICS_DIRECTORY scraped on this host
+        self.metrics_directory = tempfile.TemporaryDirectory(prefix='softdesk-test-metrics-')
+        self.metrics_settings = override_settings(METRICS_DIRECTORY=self.metrics_directory.name)
+        self.metrics_settings.enable()
+        metrics.registry.reset()
+
+    def teardown_test_environment(self, **kwargs):
+        self.metrics_settings.disable()
+        self.metrics_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
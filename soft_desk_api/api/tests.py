@@ -1,3 +1,1396 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import decimal
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+from itertools import combinations
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    benchmarks, counters, db_routers, etags, events, export, membership, metrics, middleware, profiling, renderers,
+    search, stats, sync
+)
+from .authentication import user_cache
+from .importer import NDJSONImporter
+from .models import Comment, Project, ReplicaHeartbeat, Ticket, TicketSummary, Tombstone, User
+
+
+class SoftDeskTestCase(TestCase):
+    "Base test case providing a small project with tickets and comments."
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='creator', password='secret-password')
+        cls.contributors = [
+            User.objects.create_user(username=f'contributor-{i}', password='secret-password')
+            for i in range(5)
+        ]
+        cls.project = Project.objects.create(
+            creator=cls.user, name='softdesk', description='Project', type=Project.BACKEND)
+        cls.project.contributor.add(cls.user, *cls.contributors)
+        cls.tickets = [
+            Ticket.objects.create(
+                affected_user=cls.user, assigned_to=cls.contributors[i % 5],
+                project=cls.project, title=f'Ticket {i}', details='Details')
+            for i in range(10)
+        ]
+        cls.comments = [
+            Comment.objects.create(parent_ticket=cls.tickets[0], text=f'Comment {i}')
+            for i in range(10)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertMaxQueries(self, budget, method, url, **kwargs):
+        "Call the endpoint and fail if it runs more SQL queries than its budget."
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertLessEqual(
+            len(context.captured_queries), budget,
+            f'{method.upper()} {url} ran {len(context.captured_queries)} queries '
+            f'(budget {budget}):\n' + '\n'.join(q['sql'] for q in context.captured_queries))
+        return response
+
+
+class QueryBudgetTests(SoftDeskTestCase):
+    "Every endpoint must run a fixed number of queries whatever the amount of data."
+
+    def test_user_endpoints(self):
+        self.assertMaxQueries(2, 'get', '/api/user/')
+        self.assertMaxQueries(2, 'get', f'/api/user/{self.user.id}/')
+
+    def test_project_endpoints(self):
+        self.assertMaxQueries(2, 'get', '/api/project/')
+        response = self.assertMaxQueries(2, 'get', f'/api/project/{self.project.id}/')
+        self.assertEqual(response.data['incidents_count'], 10)
+        self.assertEqual(len(response.data['contributors']), 6)
+
+    def test_project_detail_does_not_grow_with_contributors(self):
+        extra = [User(username=f'extra-{i}') for i in range(50)]
+        User.objects.bulk_create(extra)
+        self.project.contributor.add(*User.objects.filter(username__startswith='extra-'))
+        response = self.assertMaxQueries(2, 'get', f'/api/project/{self.project.id}/')
+        self.assertEqual(len(response.data['contributors']), 56)
+
+    def test_ticket_endpoints(self):
+        base = f'/api/project/{self.project.id}/ticket/'
+        self.assertMaxQueries(3, 'get', base)
+        self.assertMaxQueries(3, 'get', f'{base}{self.tickets[0].id}/')
+
+    def test_comment_endpoints(self):
+        base = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/comment/'
+        self.assertMaxQueries(3, 'get', base)
+        self.assertMaxQueries(2, 'get', f'{base}{self.comments[0].id}/')
+
+    def test_project_deletion_does_not_grow_with_rows(self):
+        Comment.objects.bulk_create([
+            Comment(parent_ticket=ticket, project=self.project, text='More')
+            for ticket in self.tickets for _ in range(50)])
+        self.assertMaxQueries(13, 'delete', f'/api/project/{self.project.id}/')
+        self.assertFalse(Ticket.objects.filter(project_id=self.project.id).exists())
+        self.assertFalse(Comment.objects.filter(project_id=self.project.id).exists())
+        self.assertFalse(Tombstone.objects.filter(project_id=self.project.id).exists())
+        if search.is_available():
+            self.assertEqual(search.search_project(self.project.id, 'More'), [])
+
+
+class MembershipTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The test processes share nothing: the local cache stands for a shared one
+        override = self.settings(MEMBERSHIP_CACHE='default')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_membership_is_cached_per_user(self):
+        self.assertTrue(membership.is_project_contributor(self.user, self.project.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_project_contributor(self.user, self.project.id))
+            self.assertFalse(membership.is_project_contributor(self.user, self.project.id + 1))
+
+    def test_cache_is_invalidated_on_contributor_changes(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        self.assertFalse(membership.is_project_contributor(outsider, self.project.id))
+        self.project.contributor.add(outsider)
+        self.assertTrue(membership.is_project_contributor(outsider, self.project.id))
+        outsider.contributed_project.remove(self.project)
+        self.assertFalse(membership.is_project_contributor(outsider, self.project.id))
+        self.assertTrue(membership.is_project_contributor(self.contributors[0], self.project.id))
+        self.project.contributor.clear()
+        self.assertFalse(membership.is_project_contributor(self.contributors[0], self.project.id))
+
+    def test_non_contributor_cannot_access_ticket(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(
+            f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_ticket_retrieve_with_warm_cache(self):
+        url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+        self.client.get(url)
+        self.assertMaxQueries(2, 'get', url)
+
+    def test_per_process_cache_is_not_used(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+        self.client.force_authenticate(outsider)
+        with self.settings(MEMBERSHIP_CACHE=None):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            # Changed by another worker: no signal reaches this process
+            membership.Contributor.objects.create(project=self.project, user=outsider)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            membership.Contributor.objects.filter(project=self.project, user=outsider).delete()
+            self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertIsNone(cache.get(membership.CACHE_KEY.format(outsider.id)))
+
+
+class ContributorEndpointTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.team = User.objects.bulk_create([User(username=f'team-{i}') for i in range(200)])
+        self.url = f'/api/project/{self.project.id}/contributors/'
+
+    def test_add_team_in_constant_queries(self):
+        ids = [user.id for user in self.team] + [self.contributors[0].id]
+        response = self.assertMaxQueries(8, 'post', self.url, data={'contributors': ids}, format='json')
+        self.assertEqual(len(response.data['added']), 200)
+        self.assertEqual(self.project.contributor.count(), 206)
+
+    def test_remove_and_replace(self):
+        response = self.client.delete(
+            self.url, data={'contributors': [self.contributors[0].id]}, format='json')
+        self.assertEqual(response.data['removed'], [self.contributors[0].id])
+        response = self.client.put(
+            self.url, data={'contributors': [self.contributors[1].id]}, format='json')
+        self.assertEqual(
+            set(self.project.contributor.values_list('id', flat=True)),
+            {self.user.id, self.contributors[1].id})
+        self.assertFalse(membership.is_project_contributor(self.contributors[2], self.project.id))
+
+    def test_creator_cannot_be_removed(self):
+        response = self.client.delete(self.url, data={'contributors': [self.user.id]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_users_are_rejected(self):
+        response = self.client.post(self.url, data={'contributors': [999999]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrently_added_contributor_is_skipped(self):
+        # Another request added team[0] after the contributors were read
+        stale = membership.get_project_contributor_ids(self.project.id)
+        self.project.contributor.add(self.team[0])
+        with mock.patch.object(membership, 'get_project_contributor_ids', return_value=stale):
+            membership.update_contributors(self.project, add=[self.team[0].id, self.team[1].id])
+        self.assertEqual(self.project.contributor.filter(id__in=[self.team[0].id, self.team[1].id]).count(), 2)
+
+    def test_only_creator_can_manage_contributors(self):
+        self.client.force_authenticate(self.contributors[0])
+        response = self.client.post(self.url, data={'contributors': [self.team[0].id]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class PaginationTests(SoftDeskTestCase):
+
+    def test_cursor_pagination_walks_every_ticket(self):
+        url = f'/api/project/{self.project.id}/ticket/?page_size=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(ticket['id'] for ticket in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [ticket.id for ticket in self.tickets])
+
+    def test_offset_pagination_is_opt_in(self):
+        response = self.client.get(
+            f'/api/project/{self.project.id}/ticket/?pagination=offset&limit=4&offset=8')
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual([ticket['id'] for ticket in response.data['results']],
+                         [ticket.id for ticket in self.tickets[8:]])
+
+
+class TicketFilterTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/project/{self.project.id}/ticket/'
+        Ticket.objects.filter(id__in=[t.id for t in self.tickets[:4]]).update(
+            status=Ticket.RESOLVED, priority=Ticket.HIGH)
+        Ticket.objects.filter(id=self.tickets[9].id).update(assigned_to=None)
+
+    def get_ids(self, query):
+        response = self.client.get(f'{self.url}?page_size=100&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [ticket['id'] for ticket in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.get_ids('status=resolved'), [t.id for t in self.tickets[:4]])
+        self.assertEqual(self.get_ids('status=resolved&priority=low'), [])
+        self.assertEqual(len(self.get_ids('status=resolved,in_progress')), 10)
+        self.assertEqual(self.get_ids('assigned_to=none'), [self.tickets[9].id])
+        self.assertEqual(self.get_ids(f'assigned_to={self.contributors[1].id}'),
+                         [self.tickets[1].id, self.tickets[6].id])
+
+    def test_invalid_filter_values(self):
+        self.assertEqual(self.client.get(f'{self.url}?status=closed').status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?assigned_to=me').status_code, 400)
+
+    def test_ordering(self):
+        ids = self.get_ids('pagination=offset&limit=100&ordering=-priority')
+        self.assertEqual(ids[-4:], [t.id for t in self.tickets[:4]])
+        ids = self.get_ids('ordering=-title')
+        self.assertEqual(ids, [t.id for t in reversed(self.tickets)])
+
+    def test_cursor_ordering_needs_a_near_unique_field(self):
+        for field in ['status', '-priority', 'ticket_type']:
+            with self.subTest(field=field):
+                response = self.client.get(f'{self.url}?ordering={field}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ordering', response.data)
+
+    def test_every_filter_combination_uses_an_index(self):
+        params = {
+            'status': 'resolved',
+            'priority': 'high',
+            'ticket_type': 'bug',
+            'assigned_to': str(self.contributors[0].id),
+        }
+        columns = {
+            'status': 'status', 'priority': 'priority', 'ticket_type': 'ticket_type', 'assigned_to': 'assigned_to_id'}
+        for size in range(len(params) + 1):
+            for names in combinations(params, size):
+                query = '&'.join(f'{name}={params[name]}' for name in names)
+                with CaptureQueriesContext(connection) as context:
+                    self.client.get(f'{self.url}?{query}')
+                sql = [q['sql'] for q in context.captured_queries if 'FROM "api_ticket"' in q['sql']]
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql[-1]}')
+                    plan = ' '.join(row[-1] for row in cursor.fetchall())
+                self.assertNotIn('SCAN api_ticket', plan, f'{query}: {plan}')
+                constraint = re.search(r'SEARCH api_ticket USING (?:COVERING )?INDEX \w+ \((.*?)\)', plan).group(1)
+                filtered = [f'{columns[name]}=?' for name in names]
+                # SQLite searches a single index per table: every filter alone, and
+                # status with priority, is in the constraint, the others in one of them
+                if len(names) == 1 or set(names) == {'status', 'priority'}:
+                    for column in filtered:
+                        self.assertIn(column, constraint, f'{query}: {plan}')
+                elif filtered:
+                    self.assertTrue(any(column in constraint for column in filtered), f'{query}: {plan}')
+
+
+class SearchTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/project/{self.project.id}/search/'
+        self.ticket = Ticket.objects.create(
+            affected_user=self.user, project=self.project,
+            title='Login crash', details='The application crashes on login')
+        self.comment = Comment.objects.create(parent_ticket=self.tickets[1], text='Crashing on startup too')
+        other = Project.objects.create(creator=self.user, name='other', description='', type=Project.IOS)
+        Ticket.objects.create(affected_user=self.user, project=other, title='Crash', details='crash')
+
+    def test_ranked_results_scoped_to_project(self):
+        response = self.client.get(f'{self.url}?q=crash')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([(r['type'], r['id']) for r in results],
+                         [('ticket', self.ticket.id), ('comment', self.comment.id)])
+        # From the matched text column, never the project scope token
+        self.assertEqual([r['snippet'] for r in results],
+                         ['Login <mark>crash</mark>', '<mark>Crashing</mark> on startup too'])
+        results = self.client.get(f'{self.url}?q=application').data['results']
+        self.assertIn('<mark>application</mark> crashes', results[0]['snippet'])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.ticket.title = 'Logout issue'
+        self.ticket.details = 'Nothing'
+        self.ticket.save()
+        self.comment.delete()
+        self.assertEqual(self.client.get(f'{self.url}?q=crash').data['results'], [])
+        self.assertEqual(len(self.client.get(f'{self.url}?q=logout').data['results']), 1)
+
+    def test_query_syntax_is_escaped(self):
+        response = self.client.get(f'{self.url}?q=crash" OR scope:*')
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_contributor_is_denied(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(f'{self.url}?q=crash').status_code, 403)
+
+    def test_rebuild_index(self):
+        self.assertEqual(search.rebuild_index(), Ticket.objects.count() + Comment.objects.count())
+        self.assertEqual(len(self.client.get(f'{self.url}?q=crash').data['results']), 2)
+
+
+class TicketBatchTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/project/{self.project.id}/ticket/batch/'
+
+    def test_create_and_update_with_set_based_queries(self):
+        items = [
+            {'title': f'Imported {i}', 'details': 'Details', 'priority': 'high',
+             'assigned_to': self.contributors[i % 5].id}
+            for i in range(300)
+        ]
+        items.append({'id': self.tickets[0].id, 'status': 'resolved', 'assigned_to': None})
+        # 4 lookups, 3 INSERT batches (SQLite binds at most 999 parameters), 1 UPDATE, 2 savepoints,
+        # 1 incidents_count UPDATE, then 1 + one UPDATE per distinct status/priority/type/assignee
+        # for the ticket summary
+        response = self.assertMaxQueries(20, 'post', self.url, data=items, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 300)
+        self.assertEqual(response.data['updated'], [self.tickets[0].id])
+        self.assertEqual(self.project.incidents.count(), 310)
+        ticket = Ticket.objects.get(id=self.tickets[0].id)
+        self.assertEqual((ticket.status, ticket.assigned_to), ('resolved', None))
+
+    def test_per_item_errors_write_nothing(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        items = [
+            {'title': 'Valid', 'details': 'Details'},
+            {'details': 'Missing title'},
+            {'title': 'Bad assignee', 'details': 'Details', 'assigned_to': outsider.id},
+            {'id': 999999, 'title': 'Unknown'},
+        ]
+        response = self.client.post(self.url, data=items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertEqual(self.project.incidents.count(), 10)
+
+    def test_only_author_can_update(self):
+        self.client.force_authenticate(self.contributors[0])
+        response = self.client.post(
+            self.url, data=[{'id': self.tickets[0].id, 'title': 'Changed'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(SoftDeskTestCase):
+
+    def test_ndjson_export(self):
+        response = self.client.get(f'/api/project/{self.project.id}/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 20)
+        self.assertEqual([r['type'] for r in records[:12]], ['ticket'] + ['comment'] * 10 + ['ticket'])
+        self.assertEqual(records[1]['parent_ticket_id'], records[0]['id'])
+
+    def test_csv_export(self):
+        response = self.client.get(f'/api/project/{self.project.id}/export/?output=csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(rows[0]['title'], 'Ticket 0')
+
+    async def test_streams_from_the_event_loop_under_asgi(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(
+            f'/api/project/{self.project.id}/export/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        # A sync iterator would be buffered whole before the first byte is sent
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.splitlines()), 20)
+
+    async def test_async_batches(self):
+        lines = export.iter_ndjson(self.project.id)
+        batches = [batch async for batch in export.aiter_lines(lines, batch_size=8)]
+        self.assertEqual([batch.count('\n') for batch in batches], [8, 8, 4])
+
+    def test_queries_are_bounded_by_chunks(self):
+        # One cursor over the tickets and one comment query per chunk of 4 tickets
+        with self.assertNumQueries(4):
+            records = list(export.iter_records(self.project.id, chunk_size=4))
+        self.assertEqual(len(records), 20)
+
+
+class ImportTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.target = Project.objects.create(
+            creator=self.user, name='target', description='', type=Project.ANDROID)
+        self.target.contributor.add(self.user, *self.contributors)
+        self.dump = b''.join(line.encode() for line in export.iter_ndjson(self.project.id))
+
+    def test_upload_round_trips_export(self):
+        upload = SimpleUploadedFile('dump.ndjson', self.dump, content_type='application/x-ndjson')
+        response = self.client.post(
+            f'/api/project/{self.target.id}/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.data['tickets'], response.data['comments']), (10, 10))
+        imported = Ticket.objects.filter(project=self.target).order_by('id')
+        self.assertEqual([t.title for t in imported], [t.title for t in self.tickets])
+        self.assertEqual(imported[0].created_at, self.tickets[0].created_at)
+        self.assertEqual(Comment.objects.filter(parent_ticket=imported[0]).count(), 10)
+
+    def test_small_batches_and_invalid_lines(self):
+        ticket = {'type': 'ticket', 'affected_user_id': self.user.id, 'title': 'Ticket'}
+        comment = {'type': 'comment', 'parent_ticket_id': self.tickets[0].id, 'text': 'Comment'}
+        # Valid JSON with values of the wrong type
+        wrong_types = [
+            {**ticket, 'title': 5},
+            {**ticket, 'details': 5},
+            {**ticket, 'priority': ['a']},
+            {**ticket, 'affected_user_id': [self.user.id]},
+            {**ticket, 'created_at': '2024-13-45T00:00:00'},
+            {**comment, 'parent_ticket_id': [1]},
+            {**comment, 'text': {'a': 1}},
+            {**comment, 'contributor_id': [1]},
+        ]
+        lines = self.dump.splitlines() + [b'not json', b'{"type": "comment", "parent_ticket_id": -1}', b'\xff\xfe']
+        lines += [json.dumps(record).encode() for record in wrong_types]
+        stats = NDJSONImporter(self.target, batch_size=3).run(lines)
+        self.assertEqual((stats['tickets'], stats['comments'], stats['skipped']), (10, 11, 10))
+        self.assertEqual([error['line'] for error in stats['errors']], list(range(21, 31)))
+        self.assertEqual([error['error'] for error in stats['errors']][2:], [
+            'Invalid UTF-8.', 'Invalid title.', 'Invalid details.', 'Invalid priority.',
+            'Invalid affected_user_id.', 'Invalid created_at.', 'Unknown parent ticket.', 'Invalid text.',
+        ])
+
+    def test_users_must_be_contributors(self):
+        self.target.contributor.remove(self.contributors[0])
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        lines = [json.dumps({'type': 'ticket', 'id': i, 'title': 'Ticket', **fields}) for i, fields in enumerate([
+            {'affected_user_id': outsider.id},
+            {'assigned_to_id': self.contributors[0].id},
+            {'assigned_to_id': 999999},
+            {'affected_user_id': self.contributors[1].id, 'assigned_to_id': self.contributors[2].id},
+        ])]
+        stats = NDJSONImporter(self.target, default_user=self.user).run(lines)
+        self.assertEqual((stats['tickets'], stats['skipped']), (1, 3))
+        self.assertEqual([error['error'] for error in stats['errors']], [
+            'The affected user is not a project contributor.',
+            'The assigned user is not a project contributor.',
+            'The assigned user is not a project contributor.',
+        ])
+
+    def test_export_shaped_input_keeps_full_batches(self):
+        # Export output: every ticket followed by its comments
+        lines = []
+        for i in range(200):
+            lines.append(json.dumps({'type': 'ticket', 'id': i, 'title': f'Ticket {i}'}))
+            lines.append(json.dumps({'type': 'comment', 'parent_ticket_id': i, 'text': f'Comment {i}'}))
+        with CaptureQueriesContext(connection) as context:
+            stats = NDJSONImporter(self.target, default_user=self.user, batch_size=100).run(lines)
+        self.assertEqual((stats['tickets'], stats['comments'], stats['skipped']), (200, 200, 0))
+        # A few queries per batch of 100 rows, not per ticket
+        self.assertLessEqual(len(context.captured_queries), 30)
+        for ticket in Ticket.objects.filter(project=self.target):
+            self.assertEqual(list(ticket.comment_set.values_list('text', flat=True)),
+                             [ticket.title.replace('Ticket', 'Comment')])
+
+
+class CachedAuthenticationTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+        # Only the user lookups are counted: membership comes from a warm cache
+        override = self.settings(MEMBERSHIP_CACHE='default')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_user_is_loaded_once(self):
+        self.assertMaxQueries(4, 'get', self.url)
+        self.assertMaxQueries(2, 'get', self.url)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_cache_is_invalidated_on_save(self):
+        self.client.get(self.url)
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(f'/api/user/{self.user.id}/')
+        self.assertEqual(response.data['username'], 'renamed')
+
+
+class ConditionalGetTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The test processes share nothing: the local cache stands for a shared one
+        override = self.settings(ETAG_CACHE='default', MEMBERSHIP_CACHE='default')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def assertNotModified(self, url):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def assertModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_project_detail(self):
+        url = f'/api/project/{self.project.id}/'
+        etag = self.assertNotModified(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(affected_user=self.user, project=self.project, title='New', details='')
+        self.assertModified(url, etag)
+
+    def test_ticket_list(self):
+        url = f'/api/project/{self.project.id}/ticket/'
+        etag = self.assertNotModified(url)
+        self.assertModified(f'{url}?status=resolved', etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tickets[3].title = 'Changed'
+            self.tickets[3].save()
+        self.assertModified(url, etag)
+
+    def test_comment_list(self):
+        url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/comment/'
+        etag = self.assertNotModified(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comments[0].delete()
+        self.assertModified(url, etag)
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+        self.assertModified(url, etag)
+
+    def test_non_contributor_gets_no_etag(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/')
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn('ETag', response)
+
+    def test_padded_ids_share_the_scope(self):
+        url = f'/api/project/0{self.project.id}/'
+        etag = self.assertNotModified(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.name = 'renamed'
+            self.project.save()
+        self.assertModified(url, etag)
+
+    def test_no_etag_with_a_per_process_cache(self):
+        url = f'/api/project/{self.project.id}/'
+        with self.settings(ETAG_CACHE=None):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class ProjectStatsTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/project/{self.project.id}/stats/'
+
+    def test_live_stats_in_one_query(self):
+        self.tickets[0].status = Ticket.RESOLVED
+        self.tickets[0].save()
+        with self.assertNumQueries(1):
+            data = stats.project_stats(self.project.id)
+        self.assertEqual(data['total'], 10)
+        self.assertEqual(data['by_status'], {'in_progress': 9, 'on_hold': 0, 'resolved': 1})
+        self.assertEqual(data['by_priority']['low'], 10)
+        self.assertEqual(data['open_by_assignee'][0], {'assigned_to': self.contributors[1].id, 'count': 2})
+        self.assertEqual(sum(row['count'] for row in data['open_by_assignee']), 9)
+
+    def test_summary_matches_live_stats(self):
+        ticket = Ticket.objects.get(id=self.tickets[2].id)
+        ticket.priority = Ticket.HIGH
+        ticket.assigned_to = None
+        ticket.save()
+        Ticket.objects.get(id=self.tickets[3].id).delete()
+        self.client.post(f'/api/project/{self.project.id}/ticket/batch/', data=[
+            {'title': 'Batch', 'details': 'Details', 'status': 'on_hold'},
+            {'id': self.tickets[0].id, 'ticket_type': 'bug'},
+        ], format='json')
+        live = self.client.get(self.url).data
+        summary = self.client.get(f'{self.url}?source=summary').data
+        self.assertEqual(live['total'], 10)
+        self.assertEqual({**live, 'source': None}, {**summary, 'source': None})
+
+    def test_rebuild_summary(self):
+        Ticket.objects.filter(project=self.project).update(status=Ticket.ON_HOLD)
+        stats.rebuild_summary([self.project.id])
+        self.assertEqual(stats.project_stats(self.project.id, 'summary')['by_status']['on_hold'], 10)
+
+    def test_project_deletion(self):
+        self.project.delete()
+        self.assertFalse(TicketSummary.objects.exists())
+
+
+class CounterTests(SoftDeskTestCase):
+
+    def test_counters_follow_creates_and_deletes(self):
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.incidents_count, 10)
+        ticket = Ticket.objects.get(id=self.tickets[0].id)
+        self.assertEqual(ticket.comment_count, 10)
+        Comment.objects.create(parent_ticket=ticket, text='One more')
+        # Saving a stale instance must not overwrite the counter
+        ticket.title = 'Renamed'
+        ticket.save()
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.comment_count, 11)
+        ticket.delete()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.incidents_count, 9)
+
+    def test_lists_show_counts(self):
+        response = self.client.get(f'/api/project/{self.project.id}/ticket/')
+        self.assertEqual(response.data['results'][0]['comment_count'], 10)
+        response = self.client.get('/api/project/')
+        self.assertEqual(response.data['results'][0]['incidents_count'], 10)
+
+    def test_reconcile_repairs_drift(self):
+        Project.objects.update(incidents_count=42)
+        Ticket.objects.update(comment_count=7)
+        out = io.StringIO()
+        call_command('reconcile_counters', '--batch-size', '3', '--summary', stdout=out)
+        self.assertIn('Project.incidents_count: 1 rows repaired.', out.getvalue())
+        self.assertIn('Ticket.comment_count: 10 rows repaired.', out.getvalue())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.incidents_count, 10)
+        self.assertEqual(
+            sorted(Ticket.objects.values_list('comment_count', flat=True)), [0] * 9 + [10])
+
+    def test_reconcile_invalidates_etags(self):
+        Ticket.objects.filter(id=self.tickets[0].id).update(comment_count=3)
+        scopes = [('project', self.project.id), ('ticket', self.tickets[0].id), ('ticket', self.tickets[1].id)]
+        with self.settings(ETAG_CACHE='default'):
+            before = etags.get_versions(scopes)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(sum(counters.reconcile(Ticket, 'comment_count')), 1)
+            after = etags.get_versions(scopes)
+        self.assertEqual([a != b for a, b in zip(before, after)], [True, True, False])
+
+
+class DeltaSyncTests(SoftDeskTestCase):
+
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since
+        with self.settings(SYNC_SETTLE_SECONDS=0):
+            response = self.client.get(f'/api/project/{self.project.id}/changes/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_full_then_incremental_sync(self):
+        data = self.sync()
+        self.assertEqual(len(data['tickets']), 10)
+        self.assertEqual(len(data['comments']), 10)
+        self.assertEqual(data['deleted'], [])
+        self.assertFalse(data['has_more'])
+        cursor = data['cursor']
+        self.assertEqual(self.sync(cursor)['tickets'], [])
+
+        ticket = Ticket.objects.get(id=self.tickets[3].id)
+        ticket.title = 'Renamed'
+        ticket.save()
+        Comment.objects.get(id=self.comments[0].id).delete()
+        data = self.sync(cursor)
+        self.assertEqual([row['title'] for row in data['tickets']], ['Renamed'])
+        self.assertEqual(data['comments'], [])
+        self.assertEqual(
+            [(row['kind'], row['object_id']) for row in data['deleted']],
+            [(Tombstone.COMMENT, self.comments[0].id)])
+        self.assertEqual(self.sync(data['cursor'])['deleted'], [])
+
+    def test_limit_pages_through_changes(self):
+        data = self.sync(limit=4)
+        seen = [row['id'] for row in data['tickets']]
+        while data['has_more']:
+            data = self.sync(data['cursor'], limit=4)
+            seen += [row['id'] for row in data['tickets']]
+        self.assertEqual(sorted(seen), sorted(ticket.id for ticket in self.tickets))
+
+    def test_comments_are_read_in_index_order(self):
+        cursor = self.sync(limit=4)['cursor']
+        with CaptureQueriesContext(connection) as context:
+            self.sync(cursor)
+        sql = [q['sql'] for q in context.captured_queries if 'FROM "api_comment"' in q['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql[-1]}')
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('comment_project_updated_idx', plan)
+        self.assertNotIn('api_ticket', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_comments_copy_the_project_of_their_ticket(self):
+        self.assertEqual({comment.project_id for comment in Comment.objects.all()}, {self.project.id})
+
+    def test_invalid_cursor(self):
+        now = timezone.now().isoformat()
+        for since in [
+            'nope',
+            # Well-formed cursors holding bad positions
+            sync.encode_cursor({'tickets': ['garbage', 1]}),
+            sync.encode_cursor({'tickets': [now, 'garbage']}),
+            sync.encode_cursor({'comments': [now]}),
+            sync.encode_cursor({'deleted': None}),
+            sync.encode_cursor(['tickets']),
+        ]:
+            with self.subTest(since=since):
+                response = self.client.get(f'/api/project/{self.project.id}/changes/', {'since': since})
+                self.assertEqual(response.status_code, 400)
+
+    def test_non_member_is_rejected(self):
+        outsider = User.objects.create_user(username='outsider', password='secret-password')
+        self.client.force_authenticate(outsider)
+        response = self.client.get(f'/api/project/{self.project.id}/changes/')
+        self.assertEqual(response.status_code, 403)
+
+
+class RecordingBroker(events.BaseBroker):
+    "Broker keeping the published events, in place of the in-process one."
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.published = []
+
+    def publish(self, project_id, event):
+        self.published.append((project_id, event['type'], event['data']))
+
+
+class EventStreamTests(SoftDeskTestCase):
+
+    def test_signals_publish_after_commit(self):
+        with self.settings(EVENT_BROKER={'BACKEND': 'api.tests.RecordingBroker'}):
+            broker = events.get_broker()
+            ticket = Ticket.objects.get(id=self.tickets[0].id)
+            with self.captureOnCommitCallbacks(execute=True):
+                ticket.assigned_to = self.contributors[4]
+                ticket.save()
+                self.assertEqual(broker.published, [])
+            with self.captureOnCommitCallbacks(execute=True):
+                ticket.title = 'Renamed'
+                ticket.save()
+                Comment.objects.create(parent_ticket=ticket, text='New comment')
+        self.assertEqual(
+            [(project_id, event_type) for project_id, event_type, data in broker.published],
+            [(self.project.id, 'ticket.updated'), (self.project.id, 'ticket.assigned'),
+             (self.project.id, 'ticket.updated'), (self.project.id, 'comment.created')])
+        self.assertEqual(broker.published[1][2]['assigned_to'], self.contributors[4].id)
+
+    def test_bulk_writes_publish_after_commit(self):
+        with self.settings(EVENT_BROKER={'BACKEND': 'api.tests.RecordingBroker'}):
+            broker = events.get_broker()
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/project/{self.project.id}/ticket/batch/', data=[
+                    {'title': 'Created', 'details': 'Details'},
+                    {'id': self.tickets[0].id, 'assigned_to': self.contributors[4].id},
+                    {'id': self.tickets[1].id, 'status': 'resolved'},
+                ], format='json')
+            self.assertEqual(response.status_code, 201)
+            created_id = response.data['created'][0]
+            self.assertEqual(
+                [(event_type, data['id']) for _, event_type, data in broker.published],
+                [('ticket.created', created_id), ('ticket.updated', self.tickets[0].id),
+                 ('ticket.assigned', self.tickets[0].id), ('ticket.updated', self.tickets[1].id)])
+            self.assertEqual(broker.published[2][2]['assigned_to'], self.contributors[4].id)
+
+            broker.published.clear()
+            lines = [
+                json.dumps({'type': 'ticket', 'id': 1, 'affected_user_id': self.user.id, 'title': 'Imported'}),
+                json.dumps({'type': 'comment', 'parent_ticket_id': 1, 'text': 'Imported comment'}),
+            ]
+            with self.captureOnCommitCallbacks(execute=True):
+                NDJSONImporter(self.project, batch_size=1).run(line.encode() for line in lines)
+        self.assertEqual(
+            [(project_id, event_type) for project_id, event_type, data in broker.published],
+            [(self.project.id, 'ticket.created'), (self.project.id, 'comment.created')])
+        self.assertEqual(broker.published[0][2]['title'], 'Imported')
+
+    async def test_in_process_broker(self):
+        broker = events.InProcessBroker({'QUEUE_SIZE': 2})
+        subscription = broker.subscribe(1)
+        other = broker.subscribe(2)
+        # Published from a worker thread, like the signal receivers of sync views
+        for i in range(3):
+            await sync_to_async(broker.publish, thread_sensitive=False)(1, {'id': i})
+        await asyncio.sleep(0)
+        # The slow subscriber gets what fits in its queue, then an overflow marker
+        self.assertEqual(await subscription.get(1), {'id': 1})
+        self.assertIsNone(await subscription.get(1))
+        with self.assertRaises(asyncio.TimeoutError):
+            await other.get(0.01)
+        broker.unsubscribe(subscription)
+        broker.unsubscribe(other)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    async def test_stream(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(
+            f'/api/project/{self.project.id}/events/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+
+        def create_ticket():
+            with self.captureOnCommitCallbacks(execute=True):
+                return Ticket.objects.create(
+                    affected_user=self.user, project=self.project, title='Live', details='Details')
+
+        ticket = await sync_to_async(create_ticket)()
+        chunk = await asyncio.wait_for(anext(stream), 1)
+        self.assertIn(b'event: ticket.created', chunk)
+        data = json.loads(chunk.split(b'data: ')[1])
+        self.assertEqual((data['id'], data['title']), (ticket.id, 'Live'))
+        # A client disconnecting cancels the task reading the stream
+        task = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(events.get_broker().subscriber_count(), 0)
+
+    async def test_stream_requires_membership(self):
+        response = await self.async_client.get(f'/api/project/{self.project.id}/events/')
+        self.assertEqual(response.status_code, 401)
+        outsider = await User.objects.acreate(username='outsider')
+        token = str(AccessToken.for_user(outsider))
+        response = await self.async_client.get(
+            f'/api/project/{self.project.id}/events/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 403)
+
+
+class AsyncReadViewTests(SoftDeskTestCase):
+
+    async def async_get(self, path, user=None, **params):
+        token = str(AccessToken.for_user(user or self.user))
+        return await self.async_client.get(
+            f'/api/async{path}', params, headers={'Authorization': f'Bearer {token}'})
+
+    async def test_same_data_as_sync_views(self):
+        ticket_path = f'/project/{self.project.id}/ticket/{self.tickets[0].id}'
+        for path, params in [
+            ('/project/', {}),
+            (f'/project/{self.project.id}/', {}),
+            (f'/project/{self.project.id}/ticket/', {}),
+            (f'/project/{self.project.id}/ticket/', {'page_size': 4, 'ordering': '-title'}),
+            (f'/project/{self.project.id}/ticket/', {'pagination': 'offset', 'limit': 4, 'offset': 2}),
+            (f'/project/{self.project.id}/ticket/', {
+                'pagination': 'offset', 'status': 'in_progress,on_hold', 'ordering': '-priority'}),
+            (f'{ticket_path}/', {}),
+            (f'{ticket_path}/comment/', {'page_size': 3}),
+            (f'{ticket_path}/comment/', {'pagination': 'offset', 'limit': 3}),
+            (f'{ticket_path}/comment/{self.comments[1].id}/', {}),
+        ]:
+            with self.subTest(path=path, params=params):
+                response = await self.async_get(path, **params)
+                self.assertEqual(response.status_code, 200, response.content)
+                expected = await sync_to_async(self.client.get)(f'/api{path}', params)
+                data, expected = json.loads(response.content), json.loads(expected.content)
+                if 'results' in expected:
+                    if 'count' in expected:
+                        self.assertEqual(data['count'], expected['count'])
+                    # The links only differ by the /async prefix
+                    self.assertEqual(
+                        [data[link] and data[link].replace('/api/async/', '/api/') for link in ('next', 'previous')],
+                        [expected['next'], expected['previous']])
+                    data, expected = data['results'], expected['results']
+                self.assertEqual(data, expected)
+
+    async def test_cursor_pages(self):
+        path = f'/project/{self.project.id}/ticket/{self.tickets[0].id}/comment/'
+        response = await self.async_get(path, page_size=4)
+        seen = []
+        while True:
+            data = response.json()
+            self.assertNotIn('count', data)
+            seen += [comment['id'] for comment in data['results']]
+            if not data['next']:
+                break
+            token = str(AccessToken.for_user(self.user))
+            response = await self.async_client.get(data['next'], headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(seen, [comment.id for comment in self.comments])
+        response = await self.async_get(f'/project/{self.project.id}/ticket/', ordering='status')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_errors(self):
+        response = await self.async_client.get('/api/async/project/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_get('/project/0/ticket/')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Project not found.'}))
+        response = await self.async_get(f'/project/{self.project.id}/ticket/', status='NOPE')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json())
+        outsider = await User.objects.acreate(username='outsider')
+        response = await self.async_get(
+            f'/project/{self.project.id}/ticket/{self.tickets[0].id}/', user=outsider)
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.post('/api/async/project/')
+        self.assertEqual(response.status_code, 405)
+
+
+class SparseFieldsTests(SoftDeskTestCase):
+
+    def ticket_url(self):
+        return f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+
+    def test_default_output_is_unchanged(self):
+        response = self.client.get(self.ticket_url())
+        self.assertEqual(response.data['assigned_to']['username'], 'contributor-0')
+        self.assertEqual(response.data['project']['name'], 'softdesk')
+
+    def test_fields_skip_the_joins(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.ticket_url(), {'fields': 'id,title,status'})
+        self.assertEqual(response.data, {'id': self.tickets[0].id, 'title': 'Ticket 0', 'status': 'in_progress'})
+        self.assertFalse([query for query in context.captured_queries if 'JOIN' in query['sql']])
+
+    def test_expand(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.ticket_url(), {'expand': 'project'})
+        self.assertEqual(response.data['assigned_to'], self.contributors[0].id)
+        self.assertEqual(response.data['affected_user'], self.user.id)
+        self.assertEqual(response.data['project']['name'], 'softdesk')
+        ticket_query = [query['sql'] for query in context.captured_queries if 'FROM "api_ticket"' in query['sql']]
+        self.assertEqual([sql.count('JOIN') for sql in ticket_query], [1])
+
+        response = self.client.get(
+            f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/comment/',
+            {'expand': 'contributor', 'fields': 'id,parent_ticket'})
+        self.assertEqual(response.data['results'][0], {'id': self.comments[0].id, 'parent_ticket': self.tickets[0].id})
+
+    def test_project_detail_without_contributors(self):
+        response = self.assertMaxQueries(
+            1, 'get', f'/api/project/{self.project.id}/', data={'fields': 'id,name,incidents_count'})
+        self.assertEqual(response.data, {'id': self.project.id, 'name': 'softdesk', 'incidents_count': 10})
+        response = self.client.get(f'/api/project/{self.project.id}/', {'expand': 'creator_detail'})
+        self.assertEqual(response.data['contributors'], [self.user.id] + [user.id for user in self.contributors])
+
+    def test_unknown_fields(self):
+        response = self.client.get(self.ticket_url(), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+        response = self.client.get(self.ticket_url(), {'expand': 'title'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FastListTests(SoftDeskTestCase):
+
+    def test_byte_identical_output(self):
+        Ticket.objects.filter(id=self.tickets[1].id).update(title='Ünïcode \u2028 "quoted"')
+        base = f'/api/project/{self.project.id}/ticket/'
+        first_page = self.client.get(base, {'page_size': 3})
+        for url, params in [
+            ('/api/user/', {}),
+            ('/api/user/', {'limit': 2, 'offset': 3, 'fields': 'username'}),
+            ('/api/project/', {}),
+            (base, {}),
+            (base, {'page_size': 3, 'ordering': '-title'}),
+            (first_page.data['next'], {}),
+            (base, {'pagination': 'offset', 'limit': 4, 'status': 'in_progress', 'fields': 'title,id'}),
+        ]:
+            with self.subTest(url=url, params=params):
+                with self.settings(FAST_LIST_SERIALIZATION=False):
+                    expected = self.client.get(url, params)
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+                # values() only reads the rendered and ordering columns
+                self.assertFalse([query for query in context.captured_queries
+                                  if '"password"' in query['sql'] or '"details"' in query['sql']])
+
+
+class RendererTests(SoftDeskTestCase):
+    payload = {
+        'id': 1,
+        'title': 'Ünïcode \u2028 \u2029 "quoted" </script>',
+        'nested': [{'created_at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)}],
+        'date': datetime.date(2024, 5, 1),
+        'amount': decimal.Decimal('12.50'),
+        'uuid': uuid.UUID(int=1),
+        'ratio': 0.1,
+        'errors': {0: ['Required.']},
+        'empty': None,
+    }
+
+    def test_json_matches_the_default_renderer(self):
+        expected = JSONRenderer().render(self.payload)
+        self.assertEqual(renderers.ORJSONRenderer().render(self.payload), expected)
+        # Indented output and a missing orjson use the stdlib encoder
+        self.assertEqual(
+            renderers.ORJSONRenderer().render(self.payload, 'application/json; indent=4'),
+            JSONRenderer().render(self.payload, 'application/json; indent=4'))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.ORJSONRenderer().render(self.payload), expected)
+
+    def test_json_round_trip(self):
+        content = renderers.ORJSONRenderer().render(self.payload)
+        self.assertEqual(
+            renderers.ORJSONParser().parse(io.BytesIO(content)), JSONParser().parse(io.BytesIO(content)))
+        response = self.client.post(
+            f'/api/project/{self.project.id}/ticket/',
+            json.dumps({'title': 'Ünïcode', 'details': 'Details'}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['title'], 'Ünïcode')
+        response = self.client.post(
+            f'/api/project/{self.project.id}/ticket/', '{"title": NaN', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(renderers.msgpack, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+        expected = self.client.get(url).json()
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), expected)
+        response = self.client.post(
+            f'/api/project/{self.project.id}/ticket/',
+            renderers.MessagePackRenderer().render({'title': 'Packed', 'details': 'Details'}),
+            content_type='application/msgpack')
+        self.assertEqual((response.status_code, response.data['title']), (201, 'Packed'))
+
+
+class QueryInstrumentationTests(SoftDeskTestCase):
+
+    def server_timing(self, response):
+        "Return {metric: {'dur': ..., 'desc': ...}} from the Server-Timing header."
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/project/{self.project.id}/ticket/')
+        timing = self.server_timing(response)
+        self.assertEqual(timing['db']['desc'], f'"{len(context.captured_queries)} queries"')
+        self.assertEqual(timing['db-dup']['desc'], '"0 duplicate queries"')
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+    def test_duplicate_queries(self):
+        with middleware.track_queries() as stats:
+            for user in [self.user, self.contributors[0], self.user]:
+                User.objects.get(pk=user.pk)
+        self.assertEqual((stats.count, stats.duplicates), (3, 1))
+        # Outside the block nothing is recorded
+        User.objects.get(pk=self.user.pk)
+        self.assertEqual(stats.count, 3)
+
+    def test_slow_log(self):
+        with self.settings(SLOW_QUERY_MS=0, SLOW_REQUEST_MS=0), self.assertLogs('api.slow', 'WARNING') as logs:
+            self.client.get(f'/api/project/{self.project.id}/')
+        entries = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual({entry['event'] for entry in entries[:-1]}, {'slow_query'})
+        self.assertEqual(entries[-1]['event'], 'slow_request')
+        self.assertEqual(entries[-1]['view'], 'project-detail')
+        self.assertEqual(entries[-1]['queries'], len(entries) - 1)
+
+    async def test_async_view_queries_are_counted(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(
+            f'/api/async/project/{self.project.id}/ticket/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.server_timing(response)['db']['desc'], '"0 queries"')
+
+    def test_disabled(self):
+        with self.settings(QUERY_INSTRUMENTATION=False):
+            # A new client loads the middleware with the current settings
+            client = APIClient()
+            client.force_authenticate(self.user)
+            response = client.get(f'/api/project/{self.project.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+
+class RequestProfilingTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiles = self.settings(PROFILING_DIRECTORY=self.directory)
+        profiles.enable()
+        self.addCleanup(profiles.disable)
+        # The middleware checks the JWT of the request itself
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.ticket_url = f'/api/project/{self.project.id}/ticket/{self.tickets[0].id}/'
+
+    def test_superuser_header(self):
+        response = self.client.patch(self.ticket_url, {'title': 'Profiled'}, HTTP_X_PROFILE='cprofile')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        User.objects.filter(pk=self.user.pk).update(is_superuser=True)
+        user_cache.clear()
+        response = self.client.patch(self.ticket_url, {'title': 'Profiled'}, HTTP_X_PROFILE='cprofile')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Profiled')
+        name = response['X-Profile-File']
+        self.assertEqual(os.listdir(self.directory), [name])
+        self.assertRegex(name, r'^\d{8}T\d{6}_\d{6}-TicketViewSet-partial_update-\d+ms-\d+\.prof$')
+
+        output = io.StringIO()
+        call_command('profile_hotspots', self.directory, action='partial_update', strip_dirs=True, stdout=output)
+        self.assertIn('1 profiles', output.getvalue())
+        self.assertIn('(partial_update)', output.getvalue())
+
+    def test_sampling_and_rotation(self):
+        with self.settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_MODE='sampler', PROFILING_MAX_FILES=2):
+            for _ in range(3):
+                self.assertEqual(self.client.get(f'/api/project/{self.project.id}/stats/').status_code, 200)
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all('-ProjectViewSet-stats-' in name and name.endswith('.folded') for name in names))
+
+        sampler = profiling.Sampler(interval=0.001)
+        with sampler:
+            sum(i * i for i in range(300000))
+        self.assertTrue(sampler.samples)
+        path = os.path.join(self.directory, 'samples.folded')
+        sampler.dump(path)
+        self.assertEqual(sum(profiling.parse_folded(path).values()), sum(sampler.samples.values()))
+
+
+class MetricsTests(SoftDeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overrides = self.settings(
+            METRICS_DIRECTORY=self.directory, METRICS_FLUSH_INTERVAL=0, METRICS_TOKEN='scrape-token')
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def scrape(self):
+        "Return {series: value} from the metrics endpoint."
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return {
+            series: float(value)
+            for series, value in (line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                                  if not line.startswith('#'))
+        }
+
+    def test_requests_by_viewset_action_and_status(self):
+        tickets = f'/api/project/{self.project.id}/ticket/'
+        self.client.get(tickets)
+        self.client.get(tickets)
+        self.client.patch(f'{tickets}{self.tickets[0].id}/', {'title': 'Changed'})
+        self.client.get(f'{tickets}0/')
+        series = self.scrape()
+
+        labels = 'viewset="TicketViewSet",action="list"'
+        self.assertEqual(series[f'softdesk_http_requests_total{{{labels},method="GET",status="200"}}'], 2)
+        self.assertEqual(series[
+            'softdesk_http_requests_total{viewset="TicketViewSet",action="partial_update",method="PATCH",'
+            'status="200"}'], 1)
+        self.assertEqual(series[
+            'softdesk_http_requests_total{viewset="TicketViewSet",action="retrieve",method="GET",status="404"}'], 1)
+        self.assertEqual(series[f'softdesk_http_request_duration_seconds_count{{{labels}}}'], 2)
+        self.assertEqual(series[f'softdesk_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'], 2)
+        self.assertLessEqual(
+            series[f'softdesk_http_request_duration_seconds_bucket{{{labels},le="0.005"}}'],
+            series[f'softdesk_http_request_duration_seconds_bucket{{{labels},le="10.0"}}'])
+        self.assertGreater(series[f'softdesk_db_queries_total{{{labels}}}'], 0)
+        self.assertGreater(series[f'softdesk_http_request_db_seconds_sum{{{labels}}}'], 0)
+
+    def test_auth_cache_and_worker_processes(self):
+        before = self.scrape()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        client.get('/api/project/')
+        client.get('/api/project/')
+        # Another worker process wrote its own file
+        with open(os.path.join(self.directory, '1-worker.json'), 'w') as worker:
+            json.dump({'counters': [['softdesk_http_requests_total', [
+                ['viewset', 'ProjectViewSet'], ['action', 'list'], ['method', 'GET'], ['status', '200']], 3]],
+                'histograms': []}, worker)
+        after = self.scrape()
+
+        self.assertEqual(after[
+            'softdesk_http_requests_total{viewset="ProjectViewSet",action="list",method="GET",status="200"}'], 5)
+        self.assertEqual(after['softdesk_auth_cache_misses_total'] - before['softdesk_auth_cache_misses_total'], 1)
+        self.assertEqual(after['softdesk_auth_cache_hits_total'] - before['softdesk_auth_cache_hits_total'], 1)
+
+    def test_unknown_methods_share_one_series(self):
+        self.client.generic('PROPFIND', '/api/project/')
+        self.client.generic('BREW', '/api/project/')
+        series = self.scrape()
+        self.assertEqual(series[
+            'softdesk_http_requests_total{viewset="ProjectViewSet",action="other",method="other",status="405"}'], 2)
+        self.assertFalse([name for name in series if 'propfind' in name.lower() or 'brew' in name.lower()])
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.assertEqual(
+            self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        # Without a token the endpoint is only open while developing
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+
+    def test_every_route_is_benchmarked(self):
+        benchmarks.seed(200)
+        self.assertEqual(Ticket.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 400)
+        report = benchmarks.run(repeat=2)
+        self.assertEqual(report['not_covered'], [])
+        for name, case in report['cases'].items():
+            self.assertLess(case['status'], 400, name)
+            self.assertGreater(case['queries'], 0, name)
+
+    def test_compare_flags_regressions(self):
+        def report(p50, queries):
+            case = {'p50_ms': p50, 'p99_ms': p50, 'queries': queries}
+            return {'sizes': {'1000': {'cases': {'ticket list': case}}}}
+
+        baseline = report(10.0, 2)
+        self.assertEqual(benchmarks.compare(report(11.0, 2), baseline), [])
+        # Relative growth under the absolute floor is noise
+        self.assertEqual(benchmarks.compare(report(0.5, 2), report(0.2, 2)), [])
+        self.assertEqual(benchmarks.compare(report(13.0, 3), baseline), [
+            '1000 ticket list: 2 -> 3 queries',
+            '1000 ticket list: p50_ms 10.0 -> 13.0',
+            '1000 ticket list: p99_ms 10.0 -> 13.0',
+        ])
+
+
+class SeedDataTests(TestCase):
+
+    def test_seed_data(self):
+        call_command('seed_data', users=50, projects=10, tickets=500, comments=1500,
+                     huge_projects=2, batch_size=128, stdout=io.StringIO())
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(Ticket.objects.count(), 500)
+        self.assertEqual(Comment.objects.count(), 1500)
+        # The huge projects share half of the tickets
+        sizes = list(Project.objects.order_by('-incidents_count').values_list('incidents_count', flat=True))
+        self.assertEqual(sizes[:2], [125, 125])
+        # Counters, summary and search index are the ones the signals and triggers would maintain
+        for model, field in counters.COUNTERS:
+            self.assertEqual(sum(counters.reconcile(model, field)), 0)
+        project = Project.objects.order_by('-incidents_count').first()
+        summary, live = stats.project_stats(project.id, 'summary'), stats.project_stats(project.id)
+        self.assertEqual({**summary, 'source': 'live'}, live)
+        self.assertTrue(search.search_project(project.id, 'issue'))
+        ticket = Ticket.objects.filter(project=project).first()
+        self.assertTrue(membership.contributor_exists(ticket.affected_user_id, project.id))
+        self.assertTrue(self.client.login(username='seed-0', password='password'))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_data', users=1, projects=1, tickets=1, comments=0, stdout=io.StringIO())
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    "Reads of the viewsets against a SQLite file copied from the primary."
+
+    # 'replica' is only added to the connections by setUpClass
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = {
+            **connections.settings['default'],
+            'NAME': os.path.join(cls.directory.name, 'replica.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='creator', password='secret-password')
+        self.reader = User.objects.create_user(username='reader', password='secret-password')
+        self.project = Project.objects.create(
+            creator=self.user, name='softdesk', description='Project', type=Project.BACKEND)
+        self.project.contributor.add(self.user, self.reader)
+        replicas = self.settings(DATABASE_REPLICAS=['replica'], REPLICA_HEALTH_CHECK_INTERVAL=0)
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+        call_command('sync_replicas', stdout=io.StringIO())
+        self.client = APIClient()
+
+    def ticket_titles(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get(f'/api/project/{self.project.id}/ticket/')
+        return [ticket['title'] for ticket in response.data['results']]
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            f'/api/project/{self.project.id}/ticket/', {'title': 'New', 'details': 'Details'})
+        self.assertEqual(response.status_code, 201)
+        # The writer reads its ticket from the primary, the replica has not received it yet
+        self.assertEqual(self.ticket_titles(self.user), ['New'])
+        self.assertEqual(self.ticket_titles(self.reader), [])
+        self.assertFalse(db_routers.reads_from_replica())
+
+        cache.clear()
+        self.assertEqual(self.ticket_titles(self.user), [])
+        call_command('sync_replicas', stdout=io.StringIO())
+        self.assertEqual(self.ticket_titles(self.reader), ['New'])
+
+    def test_lagging_or_failing_replicas_are_skipped(self):
+        Ticket.objects.create(affected_user=self.user, project=self.project, title='New', details='Details')
+        self.assertEqual(self.ticket_titles(self.reader), [])
+
+        with self.settings(REPLICA_MAX_LAG_SECONDS=-1):
+            self.assertEqual(self.ticket_titles(self.reader), ['New'])
+        with connections['replica'].cursor() as cursor:
+            cursor.execute(f'DROP TABLE {ReplicaHeartbeat._meta.db_table}')
+        self.assertEqual(db_routers.healthy_replicas(), [])
+        self.assertEqual(self.ticket_titles(self.reader), ['New'])
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested.routers import NestedDefaultRouter
 from api.views import UserViewSet, ProjectViewSet, TicketViewSet, CommentViewSet
+from api import async_views, metrics
 
 
 # Main router for users and projects
@@ -19,8 +20,22 @@ ticket_router = NestedDefaultRouter(project_router, r'ticket', lookup='ticket')
 ticket_router.register(r'comment', CommentViewSet, basename='comment')
 
 
+# Async variants of the read endpoints (GET only)
+async_urlpatterns = [
+    path('project/', async_views.project_list),
+    path('project/<int:pk>/', async_views.project_detail),
+    path('project/<int:project_pk>/ticket/', async_views.ticket_list),
+    path('project/<int:project_pk>/ticket/<int:pk>/', async_views.ticket_detail),
+    path('project/<int:project_pk>/ticket/<int:ticket_pk>/comment/', async_views.comment_list),
+    path('project/<int:project_pk>/ticket/<int:ticket_pk>/comment/<int:pk>/', async_views.comment_detail),
+]
+
+
 # URL patterns
 urlpatterns = [
+    path('project/<int:pk>/events/', async_views.project_events, name='project-events'),  # SSE stream
+    path('async/', include(async_urlpatterns)),
+    path('metrics/', metrics.metrics_view, name='metrics'),  # Prometheus scrape
     path('', include(router.urls)),  # Include main router
     path('', include(project_router.urls)),  # Include nested project routes
     path('', include(ticket_router.urls)),   # Include nested ticket routes
@@ -1,5 +1,16 @@
+# Third-party imports (Django)
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
 # Third-party imports (Django Rest Framework)
 from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
@@ -8,33 +19,48 @@ from rest_framework.permissions import IsAuthenticated, BasePermission
 
 
 # Local project imports (your serializers and models)
+from . import counters, etags, events, export, membership, search, stats, sync
+from .db_routers import ReplicaReadMixin
+from .fastpath import ValuesListMixin
+from .importer import NDJSONImporter
 from .models import Comment, Project, Ticket, User
+from .filters import StableOrderingFilter, TicketFilterBackend
+from .pagination import CursorPaginationMixin
 from .serializers import (
-    CommentSerializer, 
+    CommentSerializer, ContributorChangeSerializer, rendered_relations,
     ProjectDetailSerializer, ProjectSerializer, 
-    TicketDetailSerializer, TicketSerializer, 
+    TicketBatchItemSerializer, TicketDetailSerializer, TicketSerializer, 
     UserDetailSerializer, UserSerializer
 )
 
 class IsProjectContributor(BasePermission):
     #Custom permission to ensure only users registered to a project can perform CRUD on tickets.
     def has_object_permission(self, request, view, obj):
-        # Get the project associated with the ticket (obj is the ticket)
-        project = obj.project
-        # Check if the authenticated user is associated with the project
+        # Check if the authenticated user is associated with the project of the ticket
+        # using the cached project ids of the user instead of loading every contributor
         if any((
             request.user.is_superuser, 
-            request.user in project.contributor.all()
+            membership.is_project_contributor(request.user, obj.project_id)
             )):
             return True
         # Otherwise, deny permission
         raise PermissionDenied('You do not have permission to do this action')
 
       
-class UserViewSet(ModelViewSet):
+class UserViewSet(ReplicaReadMixin, ValuesListMixin, ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = User.objects.order_by('id')
+        if self.action == 'list':
+            return queryset
+        # The detail serializer nests the projects the user contributes to, unless ?fields= leaves them out
+        if 'contributed_project' not in rendered_relations(self.get_serializer()):
+            return queryset
+        return queryset.prefetch_related(
+            Prefetch('contributed_project', queryset=Project.objects.only('id', 'name', 'incidents_count')))
+
     def get_serializer_class(self):
         # Dynamically return the appropriate serializer class
         if self.action == 'list':
@@ -63,16 +89,40 @@ class UserViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)  # Allow delete
 
 
-class ProjectViewSet(ModelViewSet):
+class ProjectViewSet(ReplicaReadMixin, etags.ConditionalGetMixin, ValuesListMixin, ModelViewSet):
     queryset = Project.objects.all()
     permission_classes = [IsAuthenticated]
+    # A lagging replica would let the delta sync cursor move past rows it has not received yet
+    primary_read_actions = ('changes',)
+
+    def get_queryset(self):
+        queryset = Project.objects.order_by('id')
+        if self.action not in ('retrieve', 'update', 'partial_update'):
+            return queryset
+        # Detail actions render the creator and the contributors: join the creator
+        # and prefetch the contributors when ?fields= and ?expand= render them
+        relations = rendered_relations(self.get_serializer())
+        if relations.get('creator'):
+            queryset = queryset.select_related('creator')
+        if 'contributor' in relations:
+            queryset = queryset.prefetch_related(
+                Prefetch('contributor', queryset=User.objects.only('id', 'username').order_by('id')))
+        return queryset
 
     def get_serializer_class(self):
         # Dynamically return the appropriate serializer class
         if self.action == 'list':
             return ProjectSerializer  # Use simple serializer for listing projects
+        if self.action == 'contributors':
+            return ContributorChangeSerializer
         return ProjectDetailSerializer  # Use detailed serializer for other actions
     
+    def get_etag_scopes(self):
+        # Project detail depends on the project, its contributors and incidents, and the usernames
+        if self.action == 'retrieve':
+            return [('project', self.kwargs['pk']), etags.USERS]
+        return None
+
     def check_creator_permission(self, request):
         # Retrieve the project instance
         project = self.get_object()
@@ -80,6 +130,7 @@ class ProjectViewSet(ModelViewSet):
         # Check if the authenticated user is either the creator or a superuser
         if project.creator != authenticated_user and not authenticated_user.is_superuser:
             raise PermissionDenied('You do not have permission to modify or delete this project.')
+        return project
     
     def perform_create(self, serializer):
         user = self.request.user
@@ -107,14 +158,120 @@ class ProjectViewSet(ModelViewSet):
         # Proceed with the deletion if permission is granted
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=True, methods=['post', 'put', 'delete'])
+    def contributors(self, request, pk=None):
+        # POST adds, DELETE removes and PUT replaces the contributors of the project
+        project = self.check_creator_permission(request)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data['contributors']
+
+        # The creator always stays a contributor of the project
+        if request.method == 'POST':
+            added, removed = membership.update_contributors(project, add=user_ids)
+        elif request.method == 'DELETE':
+            if project.creator_id in user_ids:
+                raise ValidationError({'contributors': 'The project creator cannot be removed.'})
+            added, removed = membership.update_contributors(project, remove=user_ids)
+        else:
+            added, removed = membership.update_contributors(
+                project, replace=user_ids | {project.creator_id})
+
+        return Response({'added': sorted(added), 'removed': sorted(removed)})
+
+    @action(detail=True, methods=['get'])
+    def search(self, request, pk=None):
+        # Ranked full-text search over the tickets and comments of the project (?q=)
+        project = self.get_object()
+        if not (request.user.is_superuser or membership.is_project_contributor(request.user, project.id)):
+            raise PermissionDenied('You do not have permission to do this action')
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), settings.MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        return Response({'results': search.search_project(project.id, query, max(limit, 1))})
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        # Ticket counts by status, priority and type, and open tickets per assignee
+        # (?source=summary reads the incrementally maintained summary table)
+        project = self.get_object()
+        if not (request.user.is_superuser or membership.is_project_contributor(request.user, project.id)):
+            raise PermissionDenied('You do not have permission to do this action')
+        # Large projects are served from the summary table unless ?source=live is given
+        default_source = (
+            'summary' if project.incidents_count >= settings.PROJECT_STATS_SUMMARY_THRESHOLD else 'live')
+        source = request.query_params.get('source', default_source)
+        if source not in ('live', 'summary'):
+            raise ValidationError({'source': 'Choose from live or summary.'})
+        return Response(stats.project_stats(project.id, source))
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        # Tickets, comments and deletions changed since ?since=<cursor> (everything without a cursor)
+        project = self.get_object()
+        if not (request.user.is_superuser or membership.is_project_contributor(request.user, project.id)):
+            raise PermissionDenied('You do not have permission to do this action')
+        try:
+            limit = min(int(request.query_params.get('limit', 100)), settings.MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        try:
+            result = sync.changes_since(project.id, request.query_params.get('since'), max(limit, 1))
+        except sync.InvalidCursor as error:
+            raise ValidationError({'since': str(error)})
+        return Response(result)
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        # Stream every ticket of the project with its comments (?output=ndjson|csv)
+        project = self.get_object()
+        if not (request.user.is_superuser or membership.is_project_contributor(request.user, project.id)):
+            raise PermissionDenied('You do not have permission to do this action')
+        output = request.query_params.get('output', 'ndjson')
+        if output not in export.FORMATS:
+            raise ValidationError({'output': f'Choose from {sorted(export.FORMATS)}.'})
+        generator, content_type = export.FORMATS[output]
+        content = generator(project.id)
+        if isinstance(request._request, ASGIRequest):
+            # Django would consume a sync generator with sync_to_async(list) before sending it
+            content = export.aiter_lines(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="project-{project.id}.{output}"'
+        return response
+
+    @action(detail=True, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_tickets(self, request, pk=None):
+        # Import an uploaded NDJSON file ("file" field) of tickets and comments into the project
+        project = self.check_creator_permission(request)
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'An NDJSON file is required.'})
+        # Uploaded files are read line by line, large uploads stay on disk
+        result = NDJSONImporter(project, default_user=request.user).run(upload)
+        return Response(result, status=status.HTTP_201_CREATED)
+
 
-class TicketViewSet(ModelViewSet):
+class TicketViewSet(ReplicaReadMixin, etags.ConditionalGetMixin, CursorPaginationMixin, ValuesListMixin,
+                   ModelViewSet):
     queryset = Ticket.objects.all()
     permission_classes = [IsAuthenticated, IsProjectContributor]
+    # ?status=&priority=&ticket_type=&assigned_to= filters and ?ordering= sorting
+    filter_backends = [TicketFilterBackend, StableOrderingFilter]
+    ordering_fields = ['created_at', 'priority', 'status', 'ticket_type', 'title', 'id']
+    # Fields with few distinct values are only sorted on with ?pagination=offset
+    cursor_ordering_fields = ['created_at', 'title', 'id']
+    ordering = ['created_at', 'id']
+
     def get_serializer_class(self):
         # Dynamically return the appropriate serializer class
         if self.action == 'list':
             return TicketSerializer
+        if self.action == 'batch':
+            return TicketBatchItemSerializer
         return TicketDetailSerializer
 
     def get_project(self):
@@ -132,7 +289,23 @@ class TicketViewSet(ModelViewSet):
         # Use the helper method to get the project
         project = self.get_project()
         # Filter tickets by project
-        return Ticket.objects.filter(project=project)
+        queryset = Ticket.objects.filter(project=project).order_by('created_at', 'id')
+        if self.action == 'list':
+            return queryset
+        # The detail serializer nests the users and the project, join the ones ?fields= and ?expand= keep
+        nested = [source for source, nested in rendered_relations(self.get_serializer()).items() if nested]
+        # select_related() without fields would join every relation
+        return queryset.select_related(*nested) if nested else queryset
+
+    def get_etag_scopes(self):
+        # Only answer 304 to the users allowed to read the tickets of the project
+        project_id = self.kwargs.get('project_pk')
+        user = self.request.user
+        if not (user.is_superuser or membership.is_project_contributor(user, project_id)):
+            return None
+        if self.action == 'list':
+            return [('project', project_id), etags.USERS]
+        return [('ticket', self.kwargs['pk']), ('project', project_id), etags.USERS]
 
     def check_ticket_permission(self):
         authenticated_user = self.request.user
@@ -144,15 +317,8 @@ class TicketViewSet(ModelViewSet):
             ]):
             raise PermissionDenied('You do not have permission to modify or delete this ticket')
     
-    def list_contributor(self):
-        project = self.get_project()
-        contributors = project.contributor.all()  # Use a different variable name for clarity
-        return contributors  # Return the list of contributor objects
-    
     def ticket_assinge(self, request):
-        contributors = self.list_contributor()  # Call the method to get the list
-        data = request.data.copy()
-        assigned_to_id = data.get('assigned_to')
+        assigned_to_id = request.data.get('assigned_to')
 
             # If 'assigned_to' is explicitly passed as None, unassign the ticket
         if assigned_to_id in [None, '']:
@@ -162,8 +328,8 @@ class TicketViewSet(ModelViewSet):
             assigned_to = User.objects.get(id=assigned_to_id)
         except User.DoesNotExist:
             raise NotFound('User not found')
-        # Ensure the user is a project contributor
-        if assigned_to not in contributors:
+        # Ensure the user is a project contributor (indexed lookup on the through table)
+        if not membership.contributor_exists(assigned_to.id, self.kwargs.get('project_pk')):
             raise PermissionDenied(
                 'The user you are trying to assign the ticket to is not a project contributor.')
         return assigned_to  # Return the assigned user
@@ -194,9 +360,102 @@ class TicketViewSet(ModelViewSet):
         serializer.save()
         
         return super().partial_update(request, *args, **kwargs)
-        
 
-class CommentViewSet(ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def batch(self, request, project_pk=None):
+        # Create (items without id) and update (items with id) many tickets in one transaction
+        project = self.get_project()
+        user = request.user
+        if not (user.is_superuser or membership.is_project_contributor(user, project.id)):
+            raise PermissionDenied('You do not have permission to do this action')
+
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'detail': 'Expected a non-empty list of tickets.'})
+        if len(items) > settings.TICKET_BATCH_MAX_SIZE:
+            raise ValidationError(
+                {'detail': f'A batch holds at most {settings.TICKET_BATCH_MAX_SIZE} tickets.'})
+
+        # Validate every item on its own
+        errors = {}
+        valid = []
+        for index, item in enumerate(items):
+            serializer = TicketBatchItemSerializer(
+                data=item, partial=isinstance(item, dict) and 'id' in item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                errors[index] = serializer.errors
+
+        # Resolve the assignees and the updated tickets of the whole batch with one query each
+        assignee_ids = {data['assigned_to'] for _, data in valid if data.get('assigned_to')}
+        contributor_ids = set(membership.Contributor.objects.filter(
+            project_id=project.id, user_id__in=assignee_ids).values_list('user_id', flat=True))
+        update_ids = [data['id'] for _, data in valid if 'id' in data]
+        existing = Ticket.objects.filter(project=project, id__in=update_ids).in_bulk()
+
+        to_create = []
+        to_update = {}
+        reassigned = set()
+        update_fields = set()
+        for index, data in valid:
+            assigned_to_id = data.pop('assigned_to', None)
+            if assigned_to_id and assigned_to_id not in contributor_ids:
+                errors[index] = {'assigned_to': [
+                    'The user you are trying to assign the ticket to is not a project contributor.']}
+                continue
+            ticket_id = data.pop('id', None)
+            if ticket_id is None:
+                to_create.append(Ticket(
+                    project=project, affected_user=user, assigned_to_id=assigned_to_id, **data))
+                continue
+            ticket = existing.get(ticket_id)
+            if ticket is None or ticket_id in to_update:
+                errors[index] = {'id': ['Ticket not found or given twice in the batch.']}
+            elif ticket.affected_user_id != user.id and not user.is_superuser:
+                errors[index] = {'id': ['You do not have permission to modify this ticket.']}
+            else:
+                for field, value in data.items():
+                    setattr(ticket, field, value)
+                # bulk_update does not apply auto_now
+                ticket.updated_at = timezone.now()
+                update_fields.update(data)
+                update_fields.add('updated_at')
+                if 'assigned_to' in items[index]:
+                    if ticket.assigned_to_id != assigned_to_id:
+                        reassigned.add(ticket_id)
+                    ticket.assigned_to_id = assigned_to_id
+                    update_fields.add('assigned_to')
+                to_update[ticket_id] = ticket
+
+        # Nothing is written when any item is invalid
+        if errors:
+            return Response(
+                {'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)]},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            created = Ticket.objects.bulk_create(to_create)
+            if to_update and update_fields:
+                Ticket.objects.bulk_update(to_update.values(), sorted(update_fields))
+            # Bulk writes do not send the model signals
+            counters.increment(Project, 'incidents_count', {project.id: len(created)})
+            stats.record_ticket_changes(created + list(to_update.values()))
+            etags.bump(('project', project.id), *[('ticket', ticket_id) for ticket_id in to_update])
+            for ticket in created:
+                events.publish(project.id, 'ticket.created', events.ticket_data(ticket))
+            for ticket_id, ticket in to_update.items():
+                data = events.ticket_data(ticket)
+                events.publish(project.id, 'ticket.updated', data)
+                if ticket_id in reassigned:
+                    events.publish(project.id, 'ticket.assigned', data)
+
+        return Response(
+            {'created': [ticket.id for ticket in created], 'updated': list(to_update)},
+            status=status.HTTP_201_CREATED)
+
+
+class CommentViewSet(ReplicaReadMixin, etags.ConditionalGetMixin, CursorPaginationMixin, ModelViewSet):
     serializer_class = CommentSerializer
 
     def get_ticket(self):
@@ -211,10 +470,21 @@ class CommentViewSet(ModelViewSet):
             raise NotFound(detail="Ticket not found.")
         return ticket
     
+    def get_etag_scopes(self):
+        # Comments depend on their ticket (bumped by every comment change) and the usernames
+        user = self.request.user
+        if not (user.is_superuser or membership.is_project_contributor(user, self.kwargs.get('project_pk'))):
+            return None
+        return [('ticket', self.kwargs.get('ticket_pk')), etags.USERS]
+
     def get_queryset(self):
         # Use get_ticket() to get the ticket and filter comments
         ticket = self.get_ticket()
-        return Comment.objects.filter(parent_ticket=ticket)
+        # The serializer nests the contributor and the parent ticket of every comment,
+        # join the ones ?fields= and ?expand= keep
+        queryset = Comment.objects.filter(parent_ticket=ticket).order_by('created_at', 'id')
+        nested = [source for source, nested in rendered_relations(self.get_serializer()).items() if nested]
+        return queryset.select_related(*nested) if nested else queryset
 
     def create(self, request, *args, **kwargs):
         # Use get_ticket() to get the ticket
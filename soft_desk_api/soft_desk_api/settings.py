@@ -1,3 +1,5 @@
+import tempfile
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
 
@@ -33,6 +35,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware
+    'api.middleware.QueryInstrumentationMiddleware',
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -40,10 +45,57 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, it calls the view itself
+    'api.middleware.RequestProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'soft_desk_api.urls'
 
+# Query counts and timings in a Server-Timing header of every response (see api/middleware.py)
+QUERY_INSTRUMENTATION = True
+# Queries and requests slower than this are logged as JSON to the 'api.slow' logger
+SLOW_QUERY_MS = 100
+SLOW_REQUEST_MS = 1000
+
+# Profiling of single requests (see api/profiling.py): superusers send an
+# `X-Profile: cprofile` or `X-Profile: sampler` header, and this share of all
+# the requests is profiled with PROFILING_MODE
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_MODE = 'cprofile'
+PROFILING_DIRECTORY = BASE_DIR / 'profiles'
+# Only the most recent profiles are kept
+PROFILING_MAX_FILES = 500
+# Seconds between two samples; the sampler thread cannot run more often than
+# the interpreter switch interval (sys.getswitchinterval(), 5ms by default)
+PROFILING_SAMPLER_INTERVAL = 0.005
+
+# Prometheus metrics served at /api/metrics/ (see api/metrics.py). Each worker
+# process writes its metrics to its own file in METRICS_DIRECTORY, shared by
+# the workers of a host, at most every METRICS_FLUSH_INTERVAL seconds
+METRICS_ENABLED = True
+METRICS_DIRECTORY = Path(tempfile.gettempdir()) / 'softdesk-metrics'
+METRICS_FLUSH_INTERVAL = 1.0
+# Scrapes must send `Authorization: Bearer <token>`. Without a token the
+# endpoint is only served when DEBUG is True
+METRICS_TOKEN = None
+
+# Writes the metrics of the test requests to a temporary directory
+TEST_RUNNER = 'api.test_runner.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_log': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'api.slow': {'handlers': ['slow_log'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -73,6 +125,44 @@ DATABASES = {
     }
 }
 
+# Aliases of DATABASES serving the GET requests of the viewsets (see api/db_routers.py).
+# To try it locally, add a copy of the SQLite database:
+#     DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.replica.sqlite3'}
+#     DATABASE_REPLICAS = ['replica']
+# and refresh the copy with `python manage.py sync_replicas --interval 1`.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['api.db_routers.PrimaryReplicaRouter']
+# After a write, the reads of the same user go to the primary for this many seconds
+REPLICA_STICKY_SECONDS = 5
+# Replicas whose last replicated heartbeat is older than this are skipped
+REPLICA_MAX_LAG_SECONDS = 10
+# Seconds between two health checks of a replica, per process
+REPLICA_HEALTH_CHECK_INTERVAL = 5
+
+
+# Cache
+# Holds the per-user project membership used by the permission checks and the
+# ETag version counters. LocMemCache is private to each process: use a shared
+# backend (e.g. Redis or Memcached) when running several processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache alias holding the project ids of each user for the permission checks.
+# None: the default cache, and a live EXISTS query per check while it is a
+# per-process LocMemCache, which the other workers could not invalidate.
+MEMBERSHIP_CACHE = None
+
+# Cache alias holding the ETag version counters. None: the default cache, and
+# no ETag at all while it is a per-process LocMemCache, which would keep
+# answering 304 after another worker changed the data.
+ETAG_CACHE = None
+# Lifetime of a counter in seconds: an expired one restarts from a random value
+ETAG_VERSION_TIMEOUT = 7 * 24 * 3600
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -121,8 +211,57 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 5,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
+    # orjson when installed, the stdlib json otherwise (see api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# MessagePack (Accept/Content-Type: application/msgpack) when msgpack is installed
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('api.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('api.renderers.MessagePackParser')
+
+# Upper bound for the page_size/limit query parameters
+MAX_PAGE_SIZE = 100
+
+# Serve the user, project and ticket lists from values() rows (see api/fastpath.py)
+FAST_LIST_SERIALIZATION = True
+
+# Maximum number of tickets accepted by /project/{id}/ticket/batch/
+TICKET_BATCH_MAX_SIZE = 1000
+
+# Projects with at least this many tickets serve /stats/ from the ticket summary table
+PROJECT_STATS_SUMMARY_THRESHOLD = 10000
+
+# /project/{id}/changes/ holds back the rows changed in the last seconds:
+# a transaction that started earlier may still commit an older updated_at
+SYNC_SETTLE_SECONDS = 2
+
+# Broker of the project activity events streamed by /project/{id}/events/ (see api/events.py).
+# The in-process broker only sees the events of its own process.
+EVENT_BROKER = {
+    'BACKEND': 'api.events.InProcessBroker',
+    'OPTIONS': {
+        # Events buffered per subscriber before a slow client is disconnected
+        'QUEUE_SIZE': 100,
+    },
+}
+# Seconds between two keep-alive comments on an idle event stream
+EVENT_STREAM_HEARTBEAT = 15
+
+# Process-local cache of the users authenticated by a JWT (see api/authentication.py)
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,  # seconds
 }
 
 